@@ -0,0 +1,31 @@
+# %%
+import os
+from corrtools.bench import run, compare
+
+# Synthetic DepMap-shaped data, so the pipeline can be timed offline. The
+# full data is ~18k genes (CRISPR) or ~19k (expression) x ~1.1k cell lines
+n_genes = 4000
+n_cells = 1100
+nan_fraction = 0.05
+
+shape = {'n_genes': n_genes, 'n_cells': n_cells}
+cases = [{'engine': 'pearsonr', **shape},
+         {'engine': 'pearsonr', 'nan_fraction': nan_fraction, **shape}]
+
+for method in ['pearson', 'spearman', 'bicor']:
+    for nans in [0., nan_fraction]:
+        cases.append({'engine': 'tiles', 'nan_fraction': nans,
+                      'method': method, **shape})
+
+cases += [{'engine': 'tiles_fdr', 'nan_fraction': nan_fraction, **shape},
+          {'engine': 'neighbors', 'nan_fraction': nan_fraction, **shape}]
+
+if __name__ == '__main__':
+    os.makedirs('benchmarks', exist_ok=True)
+    results = run(cases, 'benchmarks/bench.json')
+    print(results[['engine', 'nan_fraction', 'method', 'pairs_per_s',
+                   'peak_rss_mb', 'output_mb']])
+
+# %%
+# Compare with the results of a previous release
+# compare('benchmarks/bench-old.json', 'benchmarks/bench.json')
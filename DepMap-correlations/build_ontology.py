@@ -2,7 +2,7 @@
 import json
 import numpy as np
 import pandas as pd
-from gotools import go
+from gotools import go, semsim
 
 save_dir = 'processed_data'
 
@@ -53,4 +53,10 @@ with open(f'{save_dir}/gene_terms.json', 'w') as outfile:
     json.dump(gene_terms.to_dict(), outfile)
 # gene_terms.to_csv(f'{save_dir}/gene_terms.csv.gz', compression='gzip')
 
+# Same as a sparse gene x term matrix (CSR), with terms sorted by size, for
+# all pairs semantic similarity with gotools.semsim
+ont_sorted = semsim.sort_terms(ont_df)
+matrix = semsim.incidence(ont_sorted, gene_terms.to_dict())
+semsim.save_incidence(save_dir, matrix, gene_terms.index.tolist(), ont_sorted)
+
 # %%
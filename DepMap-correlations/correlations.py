@@ -7,11 +7,22 @@ from functools import partial
 from scipy.stats import pearsonr
 from itertools import combinations
 from statsmodels.stats.multitest import fdrcorrection
+from corrtools.engine import all_pairs, tile_pairs
+from corrtools.writer import write_tiles, read_tiles, tile_files
+from corrtools.fdr import bh_fdr
+from corrtools.neighbors import neighbors
+from corrtools.joint import write_joint_tiles
+from corrtools.incremental import build_stats, update_stats, stats_tiles
+from corrtools.shared import shared_pool, get
 
 cores = 30
 
 
-def correlation(i, dataset):
+def correlation(i, dataset=None):
+
+    # in a worker of shared_pool, the data is in shared memory
+    if dataset is None:
+        dataset = get('dataset')
 
     if i[0] % 1000 == 0 and i[1] % 1000 == 0:
         print(i)
@@ -29,16 +40,9 @@ def correlation(i, dataset):
 # crispr = pd.read_parquet('gs://gisetia-ccle/processed_data/cell_cols/'
 #                          'DepMap23Q4/CRISPRGeneEffect.pq')
 
-# gene_pairs = combinations(range(len(crispr)), 2)
-# partial_func = partial(correlation, dataset=crispr.values)
-
-
-# with mp.Pool(cores) as p:
-#     result = p.imap(partial_func, gene_pairs, chunksize=100000)
-#     result = list(result)
-
-# crispr_corr = pd.DataFrame(result, columns=['corr', 'p', 'gene1',
-#                                             'gene2', 'n'])
+# # Gene effect has nans, so pairs use their shared cell lines (pairwise
+# # complete), with 'n' the number of those cell lines
+# crispr_corr = all_pairs(crispr.values)
 # crispr_corr['p_fdr'] = fdrcorrection(crispr_corr['p'])[1]
 
 # crispr_corr[['gene1', 'gene2']] = crispr_corr[['gene1', 'gene2']].applymap(
@@ -52,27 +56,65 @@ def correlation(i, dataset):
 exp = pd.read_parquet('gs://gisetia-ccle/processed_data/cell_cols/DepMap23Q4'
                       '/OmicsExpressionProteinCodingGenesTPMLogp1.pq')
 
-gene_pairs = combinations(range(len(exp)), 2)
-partial_func = partial(correlation, dataset=exp.values)
+# All gene pairs as tiles of matrix products of the standardized matrix,
+# instead of one pearsonr call per pair. Each tile is written to disk as it
+# is computed, with genes as codes into genes.parquet. Rerun to resume.
+write_tiles(exp, 'processed_data/exp_corr')
 
-with mp.Pool(cores) as p:
-    result = p.imap_unordered(partial_func, gene_pairs, chunksize=100000)
-    result = list(result)
+# Exact Benjamini-Hochberg over all tiles, adds 'p_fdr' to each of them
+bh_fdr(tile_files('processed_data/exp_corr'))
 
-exp_corr = pd.DataFrame(result, columns=['corr', 'p', 'gene1',
-                                         'gene2', 'n'])
-exp_corr['p_fdr'] = fdrcorrection(exp_corr['p'])[1]
+# exp_corr = read_tiles('processed_data/exp_corr')
 
-exp_corr[['gene1', 'gene2']] = exp_corr[['gene1', 'gene2']].applymap(
-    lambda x: exp.index[x])
-exp_corr.to_parquet('processed_data/exp_corr.pq')
+# # %%
+# # Pair by pair with pearsonr, as before the tiled engine. Workers share one
+# # copy of the data instead of a pickled partial each
+# gene_pairs = combinations(range(len(exp)), 2)
+
+# with shared_pool(cores, dataset=exp.values) as p:
+#     result = p.imap_unordered(correlation, gene_pairs, chunksize=100000)
+#     result = list(result)
+
+# exp_corr = pd.DataFrame(result, columns=['corr', 'p', 'gene1',
+#                                          'gene2', 'n'])
 
 # # %%
-# # Merge data
+# # Rank based and robust correlations on the same tiles: 'spearman' (pearson
+# # on ranks) or 'bicor' (biweight midcorrelation, less sensitive to outlier
+# # cell lines)
+# write_tiles(exp, 'processed_data/exp_corr_bicor', method='bicor')
+# bh_fdr(tile_files('processed_data/exp_corr_bicor'))
+
+# %%
+# Only the strongest pairs: top 100 partners of each gene by |r|, as an edge
+# list with the gene codes of processed_data/exp_corr/genes.parquet
+exp_neighbors = neighbors(exp.values, k=100)
+exp_neighbors.to_parquet('processed_data/exp_neighbors.pq')
+
+# # %%
+# # Incremental refresh for a new DepMap release: sufficient statistics are
+# # stored once, then only new cell lines and new genes are computed
+
+# build_stats(exp, 'processed_data/exp_stats')
+
+# exp_new = pd.read_parquet('gs://gisetia-ccle/processed_data/cell_cols/'
+#                           'DepMap24Q2/'
+#                           'OmicsExpressionProteinCodingGenesTPMLogp1.pq')
+# update_stats(exp_new, 'processed_data/exp_stats')
+
+# exp_new_corr = pd.concat([tile_pairs(*tile) for tile
+#                           in stats_tiles('processed_data/exp_stats')])
+
+# # %%
+# # CRISPR and expression correlations together
+
+# # Both datasets on one aligned gene index, computed in the same pass over
+# # the tiles, so pairs share 'pair_id' and no merge on gene names is needed
+# write_joint_tiles({'crispr': crispr, 'exp': exp}, 'processed_data/corr')
 
-# corr = pd.merge(crispr_corr, exp_corr, left_on=['gene1', 'gene2'],
-#                 right_on=['gene1', 'gene2'], suffixes=('_crispr', '_exp'),
-#                 how='outer').query('p_fdr_crispr < 0.05 or p_fdr_exp < 0.05')
+# corr = read_tiles('processed_data/corr',
+#                   filters=[[('p_fdr_crispr', '<', 0.05)],
+#                            [('p_fdr_exp', '<', 0.05)]])
 # corr.to_parquet('processed_data/corr.pq')
 
 
@@ -0,0 +1,18 @@
+from . import engine
+from . import writer
+from . import fdr
+from . import neighbors
+from . import joint
+from . import incremental
+from . import shared
+from . import bench
+
+from importlib import reload
+reload(engine)
+reload(writer)
+reload(fdr)
+reload(neighbors)
+reload(joint)
+reload(incremental)
+reload(shared)
+reload(bench)
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import platform
+import resource
+import tempfile
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+from itertools import combinations, islice
+from scipy.stats import pearsonr
+from typing import List, Optional
+
+from .engine import all_pairs
+from .writer import write_tiles, tile_files
+from .fdr import bh_fdr
+from .neighbors import neighbors
+
+
+def synthetic(n_genes: int = 18000, n_cells: int = 1100,
+              nan_fraction: float = 0., n_factors: int = 20,
+              seed: int = 0) -> pd.DataFrame:
+    '''DepMap-shaped matrix (genes x cell lines) with gene names as index:
+    a few shared factors plus noise, so that some genes correlate, and a
+    fraction of values missing at random, as in CRISPR gene effect.
+    '''
+
+    rng = np.random.default_rng(seed)
+    loadings = rng.normal(size=(n_genes, n_factors)) * (
+        rng.random((n_genes, 1)) < 0.3)
+    data = loadings @ rng.normal(size=(n_factors, n_cells)) + rng.normal(
+        size=(n_genes, n_cells))
+
+    if nan_fraction:
+        data[rng.random(data.shape) < nan_fraction] = np.nan
+
+    return pd.DataFrame(data,
+                        index=[f'GENE{i}' for i in range(n_genes)],
+                        columns=[f'ACH-{i:06d}' for i in range(n_cells)])
+
+
+def pearsonr_pairs(dataset: np.ndarray, pairs: list) -> pd.DataFrame:
+    '''The pair by pair path of correlation in correlations.py: one pearsonr
+    call per pair, on the cell lines where both genes have values.
+    '''
+
+    result = []
+    for i in pairs:
+        nan = np.logical_or(np.isnan(dataset[i[0]]), np.isnan(dataset[i[1]]))
+        corr = pearsonr(dataset[i[0]][~nan], dataset[i[1]][~nan])
+        result.append(tuple(corr) + (*i, (~nan).sum()))
+
+    return pd.DataFrame(result, columns=['corr', 'p', 'gene1', 'gene2', 'n'])
+
+
+def dir_size(path: str) -> int:
+
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    return sum(os.path.getsize(os.path.join(root, f))
+               for root, _, files in os.walk(path) for f in files)
+
+
+def rss_mb() -> float:
+
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def run_engine(engine: str, data: pd.DataFrame, out_dir: str,
+               method: str = 'pearson', tile_size: int = 2000,
+               sample_pairs: int = 20000, k: int = 100) -> dict:
+    '''Runs one engine on 'data', writing its output to 'out_dir'. Returns
+    the number of pairs computed and the output path. 'pearsonr' only runs
+    'sample_pairs' pairs, as all pairs of DepMap would take days.
+    '''
+
+    if engine == 'pearsonr':
+        pairs = list(islice(combinations(range(len(data)), 2), sample_pairs))
+        out = f'{out_dir}/pairs.parquet'
+        pearsonr_pairs(data.values, pairs).to_parquet(out)
+        return {'pairs': len(pairs), 'out': out}
+
+    n_pairs = len(data) * (len(data) - 1) // 2
+
+    if engine == 'all_pairs':
+        out = f'{out_dir}/pairs.parquet'
+        all_pairs(data.values, tile_size, method).to_parquet(out)
+    elif engine == 'tiles':
+        out = out_dir
+        write_tiles(data, out, tile_size, method, verbose=False)
+    elif engine == 'tiles_fdr':
+        out = out_dir
+        write_tiles(data, out, tile_size, method, verbose=False)
+        bh_fdr(tile_files(out), spill_dir=out_dir)
+    elif engine == 'neighbors':
+        out = f'{out_dir}/neighbors.parquet'
+        neighbors(data.values, k=k, tile_size=tile_size,
+                  method=method).to_parquet(out)
+    else:
+        raise ValueError(f'unknown engine {engine}')
+
+    return {'pairs': n_pairs, 'out': out}
+
+
+def run_case(case: dict) -> dict:
+    '''Runs one benchmark case (engine, data shape and engine options) and
+    returns it with its timings, pairs/s, peak RSS and output size. Meant to
+    run in a fresh process, so that peak RSS is the case's own.
+    '''
+
+    case = dict(case)
+    data = synthetic(case.pop('n_genes'), case.pop('n_cells'),
+                     case.pop('nan_fraction', 0.), seed=case.pop('seed', 0))
+    engine = case.pop('engine')
+    rss_data = rss_mb()
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        t0 = time.perf_counter()
+        run = run_engine(engine, data, out_dir, **case)
+        seconds = time.perf_counter() - t0
+        size = dir_size(run['out'])
+
+    return {'seconds': seconds,
+            'pairs': run['pairs'],
+            'pairs_per_s': run['pairs'] / seconds,
+            'peak_rss_mb': rss_mb(),
+            'data_rss_mb': rss_data,
+            'output_mb': size / 2**20,
+            'output_bytes_per_pair': size / run['pairs']}
+
+
+def run(cases: List[dict], out_json: Optional[str] = None,
+        verbose: bool = True) -> pd.DataFrame:
+    '''Runs benchmark cases, each in its own process, eg
+
+    run([{'engine': 'pearsonr', 'n_genes': 2000, 'n_cells': 1100},
+         {'engine': 'tiles', 'n_genes': 2000, 'n_cells': 1100,
+          'nan_fraction': 0.05, 'method': 'spearman'}], 'bench.json')
+
+    and writes the results with the versions and machine to 'out_json', to
+    compare between releases with compare.
+    '''
+
+    results = []
+    ctx = mp.get_context('spawn')
+
+    for case in cases:
+        with ctx.Pool(1) as p:
+            result = p.apply(run_case, (case,))
+        results.append({'case': json.dumps(case, sort_keys=True), **case,
+                        **result})
+
+        if verbose:
+            print(f'{case}: {result["seconds"]:.2f} s, '
+                  f'{result["pairs_per_s"]:.3g} pairs/s, '
+                  f'RSS {result["peak_rss_mb"]:.0f} MB, '
+                  f'output {result["output_mb"]:.1f} MB')
+
+    if out_json is not None:
+        info = {'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'machine': platform.node(),
+                'cpus': os.cpu_count(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'pandas': pd.__version__}
+        with open(out_json, 'w') as outfile:
+            json.dump({'info': info, 'results': results}, outfile, indent=2,
+                      default=float)
+
+    return pd.DataFrame(results)
+
+
+def compare(old_json: str, new_json: str,
+            tolerance: float = 0.2) -> pd.DataFrame:
+    '''Matches the cases of two benchmark files and flags the ones whose
+    pairs/s dropped, or peak RSS or output size grew, by more than
+    'tolerance'.
+    '''
+
+    metrics = ['pairs_per_s', 'peak_rss_mb', 'output_mb']
+    tables = []
+    for filename in [old_json, new_json]:
+        with open(filename) as json_file:
+            table = pd.DataFrame(json.load(json_file)['results'])
+        tables.append(table.set_index('case')[metrics])
+
+    diff = tables[0].join(tables[1], lsuffix='_old', rsuffix='_new',
+                          how='inner')
+    diff['regression'] = (
+        (diff['pairs_per_s_new'] < diff['pairs_per_s_old'] * (1 - tolerance))
+        | (diff['peak_rss_mb_new'] > diff['peak_rss_mb_old'] * (1 + tolerance))
+        | (diff['output_mb_new'] > diff['output_mb_old'] * (1 + tolerance)))
+
+    return diff
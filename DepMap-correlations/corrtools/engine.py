@@ -0,0 +1,222 @@
+import warnings
+import numpy as np
+import pandas as pd
+from scipy.special import betainc
+from scipy.stats import rankdata
+from typing import Iterator
+
+methods = ['pearson', 'spearman', 'bicor']
+
+
+def standardize(data: np.ndarray) -> np.ndarray:
+    '''Centers each row (gene) and scales it to unit norm, so that the
+    pearson correlation of two rows is their dot product. Constant rows
+    become nan, as pearsonr returns nan for them.
+    '''
+
+    centered = data - data.mean(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = centered / np.sqrt((centered ** 2).sum(axis=1, keepdims=True))
+
+    # A constant row is only centered to exactly 0 when its mean is exact in
+    # floating point: otherwise the rounding residue would be scaled up
+    z[np.ptp(data, axis=1) == 0] = np.nan
+
+    return z
+
+
+def pearson_p(corr: np.ndarray, n: np.ndarray) -> np.ndarray:
+    '''Two-sided p-values of pearson correlations from n observations, with
+    the same beta distribution as scipy.stats.pearsonr.
+    '''
+
+    corr = np.clip(corr, -1, 1)
+    n = np.broadcast_to(n, np.shape(corr))
+    ab = n / 2 - 1
+
+    with np.errstate(invalid='ignore'):
+        p = 2 * betainc(ab, ab, 0.5 * (1 - np.abs(corr)))
+    p = np.where(n == 2, 1., p)
+    p[n < 2] = np.nan
+
+    return np.clip(p, 0, 1)
+
+
+def tile_bounds(n_genes: int, tile_size: int) -> Iterator[tuple]:
+    '''Yields (i0, i1, j0, j1) gene ranges of the tiles on and above the
+    diagonal of the gene x gene matrix.
+    '''
+
+    for i0 in range(0, n_genes, tile_size):
+        for j0 in range(i0, n_genes, tile_size):
+            yield (i0, min(i0 + tile_size, n_genes),
+                   j0, min(j0 + tile_size, n_genes))
+
+
+def rank(data: np.ndarray) -> np.ndarray:
+    '''Ranks the values of each gene across cell lines (average ranks for
+    ties), keeping nans.
+    '''
+
+    return rankdata(data, axis=1, nan_policy='omit')
+
+
+def biweight(data: np.ndarray) -> np.ndarray:
+    '''Returns each gene centered on its median, down-weighted with Tukey's
+    biweight (u = (x - median) / (9 * MAD)) and scaled to unit norm, so that
+    the biweight midcorrelation of two genes is their dot product. Nans are
+    set to 0 after scaling, and genes with MAD 0 become nan.
+    '''
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        med = np.nanmedian(data, axis=1, keepdims=True)
+        mad = np.nanmedian(np.abs(data - med), axis=1, keepdims=True)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        u = (data - med) / (9 * mad)
+        w = (1 - u ** 2) ** 2 * (np.abs(u) < 1)
+        a = np.nan_to_num((data - med) * w)
+        z = a / np.sqrt((a ** 2).sum(axis=1, keepdims=True))
+
+    return z
+
+
+def prepare(data: np.ndarray, method: str = 'pearson') -> dict:
+    '''Precomputes what correlation tiles need from the data (genes x cell
+    lines). Without nans, rows are standardized once, so each tile is one
+    matrix product. With nans, as in correlation in correlations.py, each
+    pair only uses the cell lines where both genes have values: tiles then
+    need the values (nans set to 0), their squares and the 0/1 masks of
+    non-nan values.
+
+    'method' can also be 'spearman', pearson on ranks, and 'bicor', biweight
+    midcorrelation (one matrix product of biweight rows). With nans, genes
+    are ranked, or weighted, over all their own values rather than over the
+    cell lines shared with each partner, so results are then close to, but
+    not the same as, scipy's spearmanr on pairwise complete values.
+    '''
+
+    if method not in methods:
+        raise ValueError(f'method must be one of {methods}')
+
+    data = np.asarray(data, dtype=np.float64)
+    mask = ~np.isnan(data)
+
+    if method == 'spearman':
+        data = rank(data)
+    elif method == 'bicor':
+        if mask.all():
+            return {'z': biweight(data), 'n': data.shape[1]}
+        return {'z': biweight(data), 'm': mask.astype(np.float64)}
+
+    if mask.all():
+        return {'z': standardize(data), 'n': data.shape[1]}
+
+    # Shifting each gene by its mean does not change correlations and
+    # reduces cancellation in the sums of compute_tile
+    with warnings.catch_warnings():
+        # Genes without any value stay all nan
+        warnings.simplefilter('ignore', RuntimeWarning)
+        shifted = data - np.nanmean(data, axis=1, keepdims=True)
+    x = np.where(mask, shifted, 0.)
+
+    return {'x': x, 'x2': x ** 2, 'm': mask.astype(np.float64)}
+
+
+def corr_from_sums(n: np.ndarray, sx: np.ndarray, sy: np.ndarray,
+                   sxx: np.ndarray, syy: np.ndarray,
+                   sxy: np.ndarray) -> np.ndarray:
+    '''Returns pearson correlations from the number of shared observations,
+    sums, sums of squares and cross-products of each pair (arrays that
+    broadcast to the shape of 'sxy'). Pairs with fewer than 2 observations,
+    or constant on them, get nan.
+    '''
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        vx = sxx - sx ** 2 / n
+        vy = syy - sy ** 2 / n
+        corr = (sxy - sx * sy / n) / np.sqrt(vx * vy)
+
+    # Constant on the shared values, up to rounding
+    flat = (vx <= 1e-12 * sxx) | (vy <= 1e-12 * syy) | (n < 2)
+    corr[np.broadcast_to(flat, corr.shape)] = np.nan
+
+    return np.clip(corr, -1, 1)
+
+
+def compute_tile(prepared: dict, i0: int, i1: int, j0: int,
+                 j1: int) -> tuple:
+    '''Returns pearson correlations of genes i0:i1 with genes j0:j1 and the
+    number of cell lines used for each pair.
+
+    In pairwise complete mode (data with nans), sums, sums of squares and
+    cross-products over the shared cell lines come from matrix products with
+    the masks, so a whole tile is computed at once. Pairs with fewer than 2
+    shared values, or constant on them, get nan (pearsonr raises or returns
+    nan).
+    '''
+
+    if 'z' in prepared:
+        z = prepared['z']
+        corr = np.clip(z[i0:i1] @ z[j0:j1].T, -1, 1)
+        if 'm' in prepared:
+            m = prepared['m']
+            return corr, (m[i0:i1] @ m[j0:j1].T).astype(np.int64)
+        return corr, np.full(corr.shape, prepared['n'])
+
+    x, x2, m = prepared['x'], prepared['x2'], prepared['m']
+    mi, mj = m[i0:i1], m[j0:j1].T
+    xi, xj = x[i0:i1], x[j0:j1].T
+
+    n = mi @ mj
+    sx = xi @ mj
+    sy = mi @ xj
+    sxx = x2[i0:i1] @ mj
+    syy = mi @ x2[j0:j1].T
+    sxy = xi @ xj
+
+    return corr_from_sums(n, sx, sy, sxx, syy, sxy), n.astype(np.int64)
+
+
+def correlation_tiles(data: np.ndarray, tile_size: int = 2000,
+                      method: str = 'pearson') -> Iterator[tuple]:
+    '''Yields (i0, j0, corr, n) for the tiles of the gene x gene correlation
+    matrix on and above the diagonal, where 'corr' holds the correlations of
+    genes i0... with genes j0... See prepare for the methods.
+    '''
+
+    prepared = prepare(data, method)
+
+    for i0, i1, j0, j1 in tile_bounds(len(data), tile_size):
+        yield (i0, j0) + compute_tile(prepared, i0, i1, j0, j1)
+
+
+def tile_pairs(i0: int, j0: int, corr: np.ndarray,
+               n: np.ndarray) -> pd.DataFrame:
+    '''Returns the gene pairs (gene1 < gene2) of a tile in the format of
+    correlation in correlations.py: 'corr', 'p', 'gene1', 'gene2', 'n'.
+    '''
+
+    # Cells with i0 + row < j0 + col
+    rows, cols = np.triu_indices(corr.shape[0], k=i0 - j0 + 1,
+                                 m=corr.shape[1])
+
+    return pd.DataFrame({'corr': corr[rows, cols],
+                         'p': pearson_p(corr[rows, cols], n[rows, cols]),
+                         'gene1': rows + i0, 'gene2': cols + j0,
+                         'n': n[rows, cols]})
+
+
+def all_pairs(data: np.ndarray, tile_size: int = 2000,
+              method: str = 'pearson') -> pd.DataFrame:
+    '''Returns correlations of all gene pairs, as the pool of correlation
+    calls in correlations.py, but computed tile by tile with matrix
+    products. Data with nans uses pairwise complete observations.
+    p-values use the Student t distribution with n - 2 degrees of freedom
+    for all methods, as scipy does for pearson and spearman.
+    '''
+
+    return pd.concat([tile_pairs(*tile) for tile
+                      in correlation_tiles(data, tile_size, method)],
+                     ignore_index=True)
@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from typing import List, Optional
+
+# Non-negative floats sort like their bit patterns, so the top bits of a
+# p-value are a histogram bin that keeps order (8 mantissa bits)
+bin_shift = 44
+n_bins = int(np.float64(1).view(np.int64) >> bin_shift) + 1
+
+spill_dtype = np.dtype([('file', np.int32), ('row', np.int64),
+                        ('p', np.float64)])
+q_dtype = np.dtype([('row', np.int64), ('q', np.float64)])
+
+
+def p_bins(p: np.ndarray) -> np.ndarray:
+
+    return (np.asarray(p, dtype=np.float64) + 0.).view(np.int64) >> bin_shift
+
+
+def read_p(filename: str, p_col: str) -> np.ndarray:
+
+    return pd.read_parquet(filename, columns=[p_col])[p_col].values
+
+
+def bh_fdr(files: List[str], p_col: str = 'p', out_col: str = 'p_fdr',
+           chunk_size: int = 20_000_000,
+           spill_dir: Optional[str] = None) -> int:
+    '''Adds Benjamini-Hochberg q-values (column 'out_col') to the p-values of
+    a dataset split in many parquet files, eg correlation tiles, without
+    ever holding all p-values in memory. Results are identical to
+    statsmodels fdrcorrection on the concatenated p-values. Nan p-values
+    are left out of the correction and get nan. Returns the number of
+    p-values.
+
+    First pass: histogram of p-values, which gives the exact rank of every
+    histogram bin. Bins are grouped in chunks of about 'chunk_size'
+    p-values, and p-values are spilled to disk by chunk with their file and
+    row. Second pass: chunks are sorted one at a time, from the largest
+    p-values to the smallest, to get exact ranks and the running minimum of
+    p * m / rank. q-values are spilled by file and written back to each
+    file. Memory is bounded by the chunk and file sizes.
+    '''
+
+    hist = np.zeros(n_bins, dtype=np.int64)
+    for filename in files:
+        p = read_p(filename, p_col)
+        hist += np.bincount(p_bins(p[~np.isnan(p)]), minlength=n_bins)
+    m = int(hist.sum())
+
+    # Whole bins go to a chunk, so ties never span chunks
+    before = np.cumsum(hist) - hist
+    bin_chunk = before // chunk_size
+    n_chunks = int(bin_chunk[-1]) + 1
+    chunk_offset = before[np.searchsorted(bin_chunk, np.arange(n_chunks))
+                          .clip(max=n_bins - 1)]
+
+    tmp_dir = tempfile.mkdtemp(dir=spill_dir)
+    try:
+        for k, filename in enumerate(files):
+            p = read_p(filename, p_col)
+            rows = np.flatnonzero(~np.isnan(p))
+            chunk = bin_chunk[p_bins(p[rows])]
+
+            order = np.argsort(chunk, kind='stable')
+            bounds = np.searchsorted(chunk[order], np.arange(n_chunks + 1))
+            for c in np.flatnonzero(np.diff(bounds)):
+                sel = order[bounds[c]:bounds[c + 1]]
+                records = np.empty(len(sel), dtype=spill_dtype)
+                records['file'] = k
+                records['row'] = rows[sel]
+                records['p'] = p[rows[sel]]
+                with open(f'{tmp_dir}/chunk_{c}.bin', 'ab') as f:
+                    records.tofile(f)
+
+        running_min = np.inf
+        for c in range(n_chunks - 1, -1, -1):
+            chunk_file = f'{tmp_dir}/chunk_{c}.bin'
+            if not os.path.exists(chunk_file):
+                continue
+            records = np.fromfile(chunk_file, dtype=spill_dtype)
+            os.remove(chunk_file)
+
+            records = records[np.argsort(records['p'], kind='stable')]
+            p = records['p']
+
+            # Tied p-values all get the rank of the last of them, which is
+            # what the reversed running minimum gives in statsmodels
+            rank = chunk_offset[c] + np.searchsorted(p, p, side='right')
+            q = p / (rank / m)
+            q = np.minimum.accumulate(q[::-1])[::-1]
+            q = np.minimum(q, running_min)
+            running_min = q[0]
+            q[q > 1] = 1
+
+            order = np.argsort(records['file'], kind='stable')
+            file_ids = records['file'][order]
+            bounds = np.searchsorted(file_ids, np.arange(len(files) + 1))
+            for k in np.flatnonzero(np.diff(bounds)):
+                sel = order[bounds[k]:bounds[k + 1]]
+                out = np.empty(len(sel), dtype=q_dtype)
+                out['row'] = records['row'][sel]
+                out['q'] = q[sel]
+                with open(f'{tmp_dir}/file_{k}.bin', 'ab') as f:
+                    out.tofile(f)
+
+        for k, filename in enumerate(files):
+            data = pd.read_parquet(filename)
+            q = np.full(len(data), np.nan)
+            q_file = f'{tmp_dir}/file_{k}.bin'
+            if os.path.exists(q_file):
+                out = np.fromfile(q_file, dtype=q_dtype)
+                q[out['row']] = out['q']
+            data[out_col] = q
+            data.to_parquet(f'{filename}.tmp', index=False)
+            os.replace(f'{filename}.tmp', filename)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    return m
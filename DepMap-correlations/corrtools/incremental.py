@@ -0,0 +1,207 @@
+import os
+import json
+import warnings
+import numpy as np
+import pandas as pd
+from typing import Iterator
+
+from .engine import corr_from_sums
+
+
+def stats_path(store_dir: str, i0: int, j0: int) -> str:
+
+    return f'{store_dir}/stats/i0={i0}/j0={j0}.npz'
+
+
+def read_meta(store_dir: str) -> dict:
+    '''Returns the store metadata: genes and cell lines in order, gene blocks
+    ([start, end) gene codes of each block of tiles) and whether the data
+    has no nans ('complete').
+    '''
+
+    with open(f'{store_dir}/meta.json') as json_file:
+        return json.load(json_file)
+
+
+def write_meta(store_dir: str, meta: dict, gene_stats: dict) -> None:
+
+    np.savez(f'{store_dir}/gene_stats.tmp.npz', **gene_stats)
+    os.replace(f'{store_dir}/gene_stats.tmp.npz',
+               f'{store_dir}/gene_stats.npz')
+    with open(f'{store_dir}/meta.json.tmp', 'w') as outfile:
+        json.dump(meta, outfile)
+    os.replace(f'{store_dir}/meta.json.tmp', f'{store_dir}/meta.json')
+
+
+def save_stats(store_dir: str, i0: int, j0: int, stats: dict) -> None:
+
+    filename = stats_path(store_dir, i0, j0)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    np.savez(f'{filename[:-4]}.tmp.npz', **stats)
+    os.replace(f'{filename[:-4]}.tmp.npz', filename)
+
+
+def shifted(data: pd.DataFrame, shift: np.ndarray) -> tuple:
+    '''Returns values minus a fixed per-gene shift, with nans set to 0, and
+    the 0/1 mask of non-nan values. The shift is kept across releases, so
+    that sums stay additive, and reduces cancellation in corr_from_sums.
+    '''
+
+    values = data.values.astype(np.float64)
+    mask = ~np.isnan(values)
+
+    return (np.where(mask, values - shift[:, None], 0.),
+            mask.astype(np.float64))
+
+
+def tile_stats(xi: np.ndarray, mi: np.ndarray, xj: np.ndarray,
+               mj: np.ndarray, complete: bool) -> dict:
+    '''Sufficient statistics of the pairs of a tile. Without nans only the
+    cross-products are needed per pair, the rest is per gene.
+    '''
+
+    if complete:
+        return {'sxy': xi @ xj.T}
+
+    return {'n': mi @ mj.T, 'sx': xi @ mj.T, 'sy': mi @ xj.T,
+            'sxx': (xi ** 2) @ mj.T, 'syy': mi @ (xj ** 2).T,
+            'sxy': xi @ xj.T}
+
+
+def block_pairs(blocks: list) -> Iterator[tuple]:
+
+    for bi, (i0, i1) in enumerate(blocks):
+        for j0, j1 in blocks[bi:]:
+            yield i0, i1, j0, j1
+
+
+def build_stats(data: pd.DataFrame, store_dir: str,
+                tile_size: int = 2000) -> None:
+    '''Stores sufficient statistics for the correlations of all gene pairs
+    of 'data' (genes x cell lines): per gene, the number of values, their
+    sum and sum of squares, and per tile of gene pairs, the cross-products
+    (plus per pair counts, sums and sums of squares over shared cell lines
+    if the data has nans). update_stats then adds new releases to them.
+    '''
+
+    complete = bool(not data.isna().values.any())
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        shift = np.nan_to_num(np.nanmean(data.values, axis=1))
+
+    x, m = shifted(data, shift)
+    blocks = [[i0, min(i0 + tile_size, len(data))]
+              for i0 in range(0, len(data), tile_size)]
+
+    for i0, i1, j0, j1 in block_pairs(blocks):
+        save_stats(store_dir, i0, j0, tile_stats(x[i0:i1], m[i0:i1],
+                                                 x[j0:j1], m[j0:j1],
+                                                 complete))
+
+    meta = {'genes': data.index.astype(str).tolist(),
+            'cells': data.columns.astype(str).tolist(),
+            'blocks': blocks, 'complete': complete}
+    gene_stats = {'shift': shift, 'n': m.sum(axis=1), 's': x.sum(axis=1),
+                  'ss': (x ** 2).sum(axis=1)}
+    write_meta(store_dir, meta, gene_stats)
+
+
+def update_stats(data: pd.DataFrame, store_dir: str,
+                 tile_size: int = 2000) -> dict:
+    '''Updates stored statistics to a new release of the data, which must
+    hold all genes and cell lines already in the store, with unchanged
+    values for them:
+    - new cell lines: their contribution is added to every stored tile, so
+      only the new columns of the data are multiplied.
+    - new genes: they get new gene codes after the old ones, in new blocks,
+      and only the tiles of their rows/columns are computed, over all cell
+      lines.
+    Returns the number of new genes and cell lines.
+    '''
+
+    meta = read_meta(store_dir)
+    gene_stats = dict(np.load(f'{store_dir}/gene_stats.npz'))
+    data = data.rename(index=str, columns=str)
+
+    old_genes, old_cells = pd.Index(meta['genes']), pd.Index(meta['cells'])
+    if missing := old_genes.difference(data.index).tolist() \
+            + old_cells.difference(data.columns).tolist():
+        raise ValueError(f'{len(missing)} genes or cell lines of the store '
+                         f'are not in the data, rebuild with build_stats')
+
+    new_genes = data.index.difference(old_genes, sort=False)
+    new_cells = data.columns.difference(old_cells, sort=False)
+    cells = old_cells.append(new_cells)
+    if meta['complete'] and data.loc[:, cells].isna().values.any():
+        raise ValueError('data has nans but the store was built without, '
+                         'rebuild with build_stats')
+
+    # New cell lines, added to the tiles of old genes
+    if len(new_cells):
+        x, m = shifted(data.loc[old_genes, new_cells], gene_stats['shift'])
+        for i0, i1, j0, j1 in block_pairs(meta['blocks']):
+            stats = dict(np.load(stats_path(store_dir, i0, j0)))
+            added = tile_stats(x[i0:i1], m[i0:i1], x[j0:j1], m[j0:j1],
+                               meta['complete'])
+            save_stats(store_dir, i0, j0,
+                       {k: stats[k] + added[k] for k in stats})
+        gene_stats['n'] = gene_stats['n'] + m.sum(axis=1)
+        gene_stats['s'] = gene_stats['s'] + x.sum(axis=1)
+        gene_stats['ss'] = gene_stats['ss'] + (x ** 2).sum(axis=1)
+
+    # New genes, tiles of new rows/columns over all cell lines
+    if len(new_genes):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            new_shift = np.nan_to_num(np.nanmean(
+                data.loc[new_genes, cells].values, axis=1))
+        shift = np.r_[gene_stats['shift'], new_shift]
+        x, m = shifted(data.loc[old_genes.append(new_genes), cells], shift)
+
+        first = len(old_genes)
+        new_blocks = [[i0, min(i0 + tile_size, len(x))]
+                      for i0 in range(first, len(x), tile_size)]
+        blocks = meta['blocks'] + new_blocks
+        for i0, i1, j0, j1 in block_pairs(blocks):
+            if j0 >= first:
+                save_stats(store_dir, i0, j0, tile_stats(x[i0:i1], m[i0:i1],
+                                                         x[j0:j1], m[j0:j1],
+                                                         meta['complete']))
+
+        meta['blocks'] = blocks
+        gene_stats = {'shift': shift,
+                      'n': np.r_[gene_stats['n'], m[first:].sum(axis=1)],
+                      's': np.r_[gene_stats['s'], x[first:].sum(axis=1)],
+                      'ss': np.r_[gene_stats['ss'],
+                                  (x[first:] ** 2).sum(axis=1)]}
+
+    meta['genes'] = old_genes.append(new_genes).tolist()
+    meta['cells'] = cells.tolist()
+    write_meta(store_dir, meta, gene_stats)
+
+    return {'new_genes': len(new_genes), 'new_cells': len(new_cells)}
+
+
+def stats_tiles(store_dir: str) -> Iterator[tuple]:
+    '''Yields (i0, j0, corr, n) tiles of correlations from the stored
+    statistics, in the format of engine.correlation_tiles (gene codes in the
+    order of the store genes), eg to write with engine.tile_pairs.
+    '''
+
+    meta = read_meta(store_dir)
+    gene_stats = np.load(f'{store_dir}/gene_stats.npz')
+    n, s, ss = gene_stats['n'], gene_stats['s'], gene_stats['ss']
+
+    for i0, i1, j0, j1 in block_pairs(meta['blocks']):
+        stats = np.load(stats_path(store_dir, i0, j0))
+        if meta['complete']:
+            n_pair = np.broadcast_to(n[i0:i1, None], stats['sxy'].shape)
+            corr = corr_from_sums(n_pair, s[i0:i1, None], s[None, j0:j1],
+                                  ss[i0:i1, None], ss[None, j0:j1],
+                                  stats['sxy'])
+        else:
+            n_pair = stats['n']
+            corr = corr_from_sums(n_pair, stats['sx'], stats['sy'],
+                                  stats['sxx'], stats['syy'], stats['sxy'])
+
+        yield i0, j0, corr, n_pair.astype(np.int64)
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+from typing import Dict
+
+from .engine import compute_tile, pearson_p, prepare
+from .fdr import bh_fdr
+from .writer import tile_files, write_genes, write_params, write_pending_tiles
+
+
+def align(datasets: Dict[str, pd.DataFrame]) -> tuple:
+    '''Returns the sorted union of the genes of all datasets (genes x cell
+    lines) and each dataset reindexed on it, with nan rows for genes it
+    lacks. Cell lines are not aligned, each dataset keeps its own.
+    '''
+
+    genes = pd.Index(sorted(set().union(*[d.index for d in
+                                          datasets.values()])))
+
+    return genes, {name: data.reindex(genes)
+                   for name, data in datasets.items()}
+
+
+def write_joint_tiles(datasets: Dict[str, pd.DataFrame], out_dir: str,
+                      tile_size: int = 2000, method: str = 'pearson',
+                      fdr: bool = True, verbose: bool = True) -> pd.Index:
+    '''Computes correlations of all gene pairs in several datasets (eg
+    {'crispr': ..., 'exp': ...}) over one aligned gene index, in the same
+    pass over the tiles, and writes one table with 'pair_id' (gene1 *
+    n_genes + gene2), 'gene1', 'gene2' (codes into genes.parquet) and
+    'corr_<name>', 'p_<name>', 'n_<name>' for every dataset. With 'fdr',
+    'p_fdr_<name>' columns are then added with bh_fdr. As write_tiles,
+    tiles are written to a partitioned dataset and a rerun resumes.
+    Returns the aligned genes.
+    '''
+
+    genes, aligned = align(datasets)
+    write_genes(pd.DataFrame(index=genes), out_dir)
+    write_params(out_dir, tile_size=tile_size, method=method,
+                 datasets=list(aligned))
+    prepared = {name: prepare(data.values, method)
+                for name, data in aligned.items()}
+    n_genes = len(genes)
+
+    def make_tile(i0: int, i1: int, j0: int, j1: int) -> pd.DataFrame:
+        rows, cols = np.triu_indices(i1 - i0, k=i0 - j0 + 1, m=j1 - j0)
+        gene1, gene2 = rows + i0, cols + j0
+
+        pairs = pd.DataFrame({
+            'pair_id': gene1.astype(np.int64) * n_genes + gene2,
+            'gene1': gene1.astype(np.int32),
+            'gene2': gene2.astype(np.int32)})
+        for name in aligned:
+            corr, n = compute_tile(prepared[name], i0, i1, j0, j1)
+            corr, n = corr[rows, cols], n[rows, cols]
+            pairs[f'corr_{name}'] = corr
+            pairs[f'p_{name}'] = pearson_p(corr, n)
+            pairs[f'n_{name}'] = n.astype(np.int32)
+
+        return pairs
+
+    write_pending_tiles(out_dir, n_genes, tile_size, make_tile, verbose)
+
+    if fdr:
+        for name in aligned:
+            bh_fdr(tile_files(out_dir), p_col=f'p_{name}',
+                   out_col=f'p_fdr_{name}')
+
+    return genes
@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from typing import Optional
+
+from .engine import compute_tile, pearson_p, prepare, tile_bounds
+
+
+def tile_scores(corr: np.ndarray, absolute: bool) -> np.ndarray:
+    '''Ranking scores of correlations: |r| or r, with nans last.
+    '''
+
+    score = np.abs(corr) if absolute else corr.copy()
+    score[np.isnan(score)] = -np.inf
+
+    return score
+
+
+def update_top(best: dict, rows: slice, cols: np.ndarray, score: np.ndarray,
+               corr: np.ndarray, n: np.ndarray) -> None:
+    '''Merges the correlations of genes 'rows' with genes 'cols' into their
+    running top-k partners.
+    '''
+
+    k = best['score'].shape[1]
+    n_rows = score.shape[0]
+
+    cand = {'score': np.hstack([best['score'][rows], score]),
+            'gene': np.hstack([best['gene'][rows],
+                               np.broadcast_to(cols, (n_rows, len(cols)))]),
+            'corr': np.hstack([best['corr'][rows], corr]),
+            'n': np.hstack([best['n'][rows], n])}
+
+    top = np.argpartition(-cand['score'], k - 1, axis=1)[:, :k]
+    for key in best:
+        best[key][rows] = np.take_along_axis(cand[key], top, axis=1)
+
+
+def neighbors(data: np.ndarray, k: Optional[int] = None,
+              threshold: Optional[float] = None, absolute: bool = True,
+              tile_size: int = 2000,
+              method: str = 'pearson') -> pd.DataFrame:
+    '''Computes correlation tiles of all gene pairs, as write_tiles, but only
+    keeps the strongest ones, as an edge list with columns 'gene1', 'gene2'
+    (int32 gene codes), 'corr', 'p' and 'n'.
+
+    With 'k', keeps the top k partners of every gene (both directions of a
+    pair may appear, one per gene), sorted by decreasing strength. With
+    'threshold', keeps pairs (gene1 < gene2) with correlation at or above
+    it. With both, keeps the top k partners above the threshold. Strength is
+    |r|, or r if not 'absolute'. Only k partners per gene are held in memory
+    besides the current tile.
+    '''
+
+    if k is None and threshold is None:
+        raise ValueError('k or threshold must be given')
+
+    prepared = prepare(data, method)
+    n_genes = len(data)
+
+    if k is not None:
+        k = min(k, n_genes - 1)
+        best = {'score': np.full((n_genes, k), -np.inf),
+                'gene': np.full((n_genes, k), -1, dtype=np.int32),
+                'corr': np.full((n_genes, k), np.nan),
+                'n': np.zeros((n_genes, k), dtype=np.int64)}
+    edges = []
+
+    for i0, i1, j0, j1 in tile_bounds(n_genes, tile_size):
+        corr, n = compute_tile(prepared, i0, i1, j0, j1)
+        score = tile_scores(corr, absolute)
+        if i0 == j0:
+            np.fill_diagonal(score, -np.inf)
+
+        if k is not None:
+            update_top(best, slice(i0, i1), np.arange(j0, j1, dtype=np.int32),
+                       score, corr, n)
+            if i0 != j0:
+                update_top(best, slice(j0, j1),
+                           np.arange(i0, i1, dtype=np.int32), score.T,
+                           corr.T, n.T)
+        else:
+            rows, cols = np.nonzero(score >= threshold)
+            keep = rows + i0 < cols + j0
+            rows, cols = rows[keep], cols[keep]
+            edges.append(pd.DataFrame({'gene1': rows + i0, 'gene2': cols + j0,
+                                       'corr': corr[rows, cols],
+                                       'n': n[rows, cols]}))
+
+    if k is not None:
+        order = np.argsort(-best['score'], axis=1, kind='stable')
+        best = {key: np.take_along_axis(v, order, axis=1)
+                for key, v in best.items()}
+        keep = best['score'] > -np.inf
+        if threshold is not None:
+            keep &= best['score'] >= threshold
+        gene1 = np.broadcast_to(np.arange(n_genes)[:, None], keep.shape)
+        edges = [pd.DataFrame({'gene1': gene1[keep],
+                               'gene2': best['gene'][keep],
+                               'corr': best['corr'][keep],
+                               'n': best['n'][keep]})]
+
+    edges = pd.concat(edges, ignore_index=True)
+    edges['p'] = pearson_p(edges['corr'].values, edges['n'].values)
+
+    return edges.astype({'gene1': np.int32, 'gene2': np.int32,
+                         'n': np.int32})[['gene1', 'gene2', 'corr', 'p', 'n']]
+
+
+def to_csr(edges: pd.DataFrame, n_genes: int, value: str = 'corr',
+           symmetric: bool = False) -> csr_matrix:
+    '''Returns an edge list as a sparse gene x gene CSR matrix of 'value'.
+    With 'symmetric', each pair is also stored as (gene2, gene1), eg for
+    threshold edges that only hold gene1 < gene2.
+    '''
+
+    rows, cols = edges['gene1'].values, edges['gene2'].values
+    values = edges[value].values
+    if symmetric:
+        rows, cols = np.r_[rows, cols], np.r_[cols, rows]
+        values = np.r_[values, values]
+
+    return csr_matrix((values, (rows, cols)), shape=(n_genes, n_genes))
@@ -0,0 +1,83 @@
+import numpy as np
+import multiprocessing as mp
+from multiprocessing.pool import Pool
+from multiprocessing.shared_memory import SharedMemory
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+# Arrays attached by the workers of shared_pool, by name
+arrays = {}
+_blocks = []
+
+
+def share(**data: np.ndarray) -> tuple:
+    '''Copies each array into a new block of shared memory. Returns the
+    blocks, to be released with release, and handles (name, shape, dtype)
+    that are cheap to pickle and enough for attach to map the arrays.
+    '''
+
+    blocks, handles = [], {}
+    for key, values in data.items():
+        values = np.ascontiguousarray(values)
+        block = SharedMemory(create=True, size=max(values.nbytes, 1))
+        np.ndarray(values.shape, values.dtype, buffer=block.buf)[...] = values
+        blocks.append(block)
+        handles[key] = (block.name, values.shape, values.dtype.str)
+
+    return blocks, handles
+
+
+def release(blocks: list) -> None:
+    '''Closes and frees shared memory blocks made by share.'''
+
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+def attach(handles: Dict[str, tuple]) -> Dict[str, np.ndarray]:
+    '''Maps the arrays of share handles in this process, without copying.
+    Arrays are read only, so workers cannot change each other's data.
+    '''
+
+    attached = {}
+    for key, (name, shape, dtype) in handles.items():
+        # Kept open for as long as the arrays are used
+        block = SharedMemory(name=name)
+        _blocks.append(block)
+        values = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        values.flags.writeable = False
+        attached[key] = values
+
+    return attached
+
+
+def init_worker(handles: Dict[str, tuple]) -> None:
+    '''Pool initializer: attaches the shared arrays once per worker.'''
+
+    arrays.update(attach(handles))
+
+
+def get(key: str) -> np.ndarray:
+    '''Returns a shared array in a worker of shared_pool.'''
+
+    return arrays[key]
+
+
+@contextmanager
+def shared_pool(cores: int, **data: np.ndarray) -> Iterator[Pool]:
+    '''mp.Pool whose workers see 'data' (name=array) through get(name), from
+    one copy in shared memory, instead of a partial pickled to every worker
+    with each chunk of tasks. Memory is freed when the pool is closed.
+
+    with shared_pool(30, dataset=exp.values) as p:
+        result = list(p.imap(correlation, gene_pairs, chunksize=100000))
+    '''
+
+    blocks, handles = share(**data)
+    try:
+        with mp.Pool(cores, initializer=init_worker,
+                     initargs=(handles,)) as pool:
+            yield pool
+    finally:
+        release(blocks)
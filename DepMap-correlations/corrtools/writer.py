@@ -0,0 +1,153 @@
+import os
+import glob
+import json
+import numpy as np
+import pandas as pd
+from typing import Callable, Optional
+
+from .engine import compute_tile, prepare, tile_bounds, tile_pairs
+
+
+def tile_path(out_dir: str, i0: int, j0: int) -> str:
+    '''Returns path of a tile in the partitioned pairs dataset.
+    '''
+
+    return f'{out_dir}/pairs/i0={i0}/j0={j0}.parquet'
+
+
+def write_genes(data: pd.DataFrame, out_dir: str) -> pd.DataFrame:
+    '''Writes the gene lookup table (gene_id -> gene), or checks that the one
+    already in 'out_dir' matches the data, so that a resumed run keeps the
+    same gene ids.
+    '''
+
+    genes = pd.DataFrame({'gene_id': np.arange(len(data), dtype=np.int32),
+                          'gene': data.index.astype(str)})
+    filename = f'{out_dir}/genes.parquet'
+
+    if os.path.exists(filename):
+        if not pd.read_parquet(filename).equals(genes):
+            raise ValueError(f'genes in {filename} do not match the data')
+    else:
+        os.makedirs(out_dir, exist_ok=True)
+        genes.to_parquet(filename)
+
+    return genes
+
+
+def write_params(out_dir: str, **params) -> dict:
+    '''Writes the parameters of a run that decide its tiles (eg tile_size
+    and method) to 'params.json', or checks that the ones already in
+    'out_dir' match, so that a resumed run does not mix tiles of different
+    sizes or methods.
+    '''
+
+    filename = f'{out_dir}/params.json'
+
+    if os.path.exists(filename):
+        with open(filename) as json_file:
+            written = json.load(json_file)
+        if written != params:
+            raise ValueError(f'{out_dir} was written with {written}, not '
+                             f'{params}')
+    else:
+        os.makedirs(out_dir, exist_ok=True)
+        with open(f'{filename}.tmp', 'w') as outfile:
+            json.dump(params, outfile)
+        os.replace(f'{filename}.tmp', filename)
+
+    return params
+
+
+def write_pending_tiles(out_dir: str, n_genes: int, tile_size: int,
+                        make_tile: Callable[[int, int, int, int],
+                                            pd.DataFrame],
+                        verbose: bool = True) -> None:
+    '''Writes the pairs table returned by make_tile(i0, i1, j0, j1) for each
+    tile of 'n_genes' genes that is not in 'out_dir' yet. Tiles are written
+    to a temporary file and renamed when complete, so that a job that died
+    can be resumed by running it again.
+    '''
+
+    bounds = list(tile_bounds(n_genes, tile_size))
+    todo = [b for b in bounds if not os.path.exists(tile_path(out_dir, b[0],
+                                                              b[2]))]
+    if verbose and len(todo) < len(bounds):
+        print(f'Resuming: {len(bounds) - len(todo)} of {len(bounds)} tiles '
+              f'already written')
+
+    for k, (i0, i1, j0, j1) in enumerate(todo):
+        pairs = make_tile(i0, i1, j0, j1)
+
+        filename = tile_path(out_dir, i0, j0)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        pairs.to_parquet(f'{filename}.tmp', index=False)
+        os.replace(f'{filename}.tmp', filename)
+
+        if verbose and not k % 100:
+            print(f'Tile {k + 1}/{len(todo)}')
+
+
+def compact_pairs(pairs: pd.DataFrame) -> pd.DataFrame:
+    '''Narrows the dtypes of tile_pairs output for storage: gene ids as
+    int32 codes into genes.parquet and n as int32.
+    '''
+
+    return pairs.astype({'gene1': np.int32, 'gene2': np.int32,
+                         'n': np.int32})
+
+
+def write_tiles(data: pd.DataFrame, out_dir: str, tile_size: int = 2000,
+                method: str = 'pearson', verbose: bool = True) -> None:
+    '''Computes correlations of all gene pairs of 'data' (genes x cell lines)
+    and writes each tile straight to a parquet dataset partitioned by tile
+    ('pairs/i0=.../j0=....parquet'), with genes as int codes into
+    'genes.parquet'. Memory is bounded by the data and one tile. Tiles that
+    already exist are skipped (see write_pending_tiles), so a job that died
+    can be resumed by running it again: genes, 'tile_size' and 'method' are
+    checked against the ones of the first run.
+    '''
+
+    write_genes(data, out_dir)
+    write_params(out_dir, tile_size=tile_size, method=method)
+    prepared = prepare(data.values, method)
+
+    def make_tile(i0: int, i1: int, j0: int, j1: int) -> pd.DataFrame:
+        corr, n = compute_tile(prepared, i0, i1, j0, j1)
+        return compact_pairs(tile_pairs(i0, j0, corr, n))
+
+    write_pending_tiles(out_dir, len(data), tile_size, make_tile, verbose)
+
+
+def tile_files(out_dir: str) -> list:
+    '''Returns paths of all written tiles, in gene order.
+    '''
+
+    files = glob.glob(f'{out_dir}/pairs/i0=*/j0=*.parquet')
+
+    def key(filename):
+        parts = filename.split('/')
+        return int(parts[-2][3:]), int(parts[-1][3:-8])
+
+    return sorted(files, key=key)
+
+
+def read_tiles(out_dir: str, columns: Optional[list] = None,
+               filters: Optional[list] = None,
+               gene_names: bool = True) -> pd.DataFrame:
+    '''Reads the pairs dataset, optionally only rows matching pyarrow
+    'filters' (eg [('p_fdr', '<', 0.05)]), applied tile by tile. With
+    'gene_names', gene codes are turned into categoricals with the names in
+    genes.parquet, without building one string per row.
+    '''
+
+    pairs = pd.concat([pd.read_parquet(f, columns=columns, filters=filters)
+                       for f in tile_files(out_dir)], ignore_index=True)
+
+    if gene_names:
+        genes = pd.read_parquet(f'{out_dir}/genes.parquet')['gene']
+        for col in ['gene1', 'gene2']:
+            if col in pairs:
+                pairs[col] = pd.Categorical.from_codes(pairs[col], genes)
+
+    return pairs
@@ -1,4 +1,5 @@
 from . import go
+from . import semsim
 # import goenrich.read
 # import goenrich.enrich
 # import goenrich.export
@@ -6,3 +7,4 @@ from . import go
 
 from importlib import reload
 reload(go)
+reload(semsim)
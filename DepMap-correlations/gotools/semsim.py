@@ -0,0 +1,456 @@
+import os
+import ast
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from scipy import sparse
+from typing import Dict, Iterator, List, Optional, Union
+
+# Terms per sparse product in min_shared_terms_sparse: their weights 2^-k
+# span at most 53 bits, so any sum of them is exact in float64
+max_chunk = 52
+
+
+def sort_terms(ont: pd.DataFrame) -> pd.DataFrame:
+    '''Returns the ontology sorted by term size (smallest, most specific
+    first), with the rank of each term as index.
+    '''
+
+    return ont.sort_values('size', kind='stable').reset_index(drop=True)
+
+
+def incidence(ont: pd.DataFrame, gene_terms: Dict[str, List[str]],
+              genes: Optional[List[str]] = None) -> sparse.csr_matrix:
+    '''Gene x term incidence matrix (CSR, int8), with terms as columns in the
+    order of 'ont' (sorted by size with sort_terms) and genes as rows in the
+    order of 'genes' (default: gene_terms). Terms not in 'ont' are ignored.
+    '''
+
+    if genes is None:
+        genes = list(gene_terms)
+
+    terms = pd.Series(genes).map(gene_terms).explode().dropna()
+    ranks = pd.Series(np.arange(len(ont)), index=ont['term_id'])
+    cols = ranks.reindex(terms.values).values
+    keep = ~np.isnan(cols)
+
+    matrix = sparse.csr_matrix(
+        (np.ones(keep.sum(), dtype=np.int8),
+         (terms.index.values[keep], cols[keep].astype(np.int64))),
+        shape=(len(genes), len(ont)))
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+
+    return matrix
+
+
+def save_incidence(save_dir: str, matrix: sparse.csr_matrix,
+                   genes: List[str], ont: pd.DataFrame) -> None:
+    '''Writes an incidence matrix as gene_terms.npz, with its rows
+    (gene_terms_genes.parquet: gene_id, gene) and columns
+    (gene_terms_terms.parquet: term_id, name, size, by rank).
+    '''
+
+    sparse.save_npz(f'{save_dir}/gene_terms.npz', matrix)
+    pd.DataFrame({'gene_id': np.arange(len(genes), dtype=np.int32),
+                  'gene': genes}).to_parquet(
+                      f'{save_dir}/gene_terms_genes.parquet')
+    ont[['term_id', 'name', 'size']].reset_index(drop=True).to_parquet(
+        f'{save_dir}/gene_terms_terms.parquet')
+
+
+def load_incidence(save_dir: str) -> tuple:
+    '''Reads the matrix, genes and terms written by save_incidence.'''
+
+    matrix = sparse.load_npz(f'{save_dir}/gene_terms.npz').tocsr()
+    genes = pd.read_parquet(f'{save_dir}/gene_terms_genes.parquet')
+    terms = pd.read_parquet(f'{save_dir}/gene_terms_terms.parquet')
+
+    return matrix, genes['gene'].tolist(), terms
+
+
+def pack_bits(matrix: sparse.csr_matrix) -> np.ndarray:
+    '''Packs an incidence matrix as bitsets (genes x words of 64 terms,
+    uint64), bit r being the term of column r.
+    '''
+
+    coo = matrix.tocoo()
+    bits = np.zeros((matrix.shape[0], (matrix.shape[1] + 63) // 64),
+                    dtype=np.uint64)
+    np.bitwise_or.at(bits, (coo.row, coo.col // 64),
+                     np.left_shift(np.uint64(1),
+                                   (coo.col % 64).astype(np.uint64)))
+
+    return bits
+
+
+def term_bits(ont: pd.DataFrame, gene_terms: Dict[str, List[str]],
+              genes: Optional[List[str]] = None) -> np.ndarray:
+    '''Encodes the terms of each gene (as in gene_terms.json) as a bitset
+    (genes x words of 64 terms, uint64), where bit r is the term of rank r
+    in 'ont' sorted by size, so that the first set bit of a & b is the
+    smallest term shared by genes a and b. Terms not in 'ont' are ignored.
+    '''
+
+    return pack_bits(incidence(ont, gene_terms, genes))
+
+
+def lowest_bit(x: np.ndarray) -> np.ndarray:
+    '''Position of the lowest set bit of each (non-zero) uint64.'''
+
+    # x & -x keeps only the lowest bit, a power of two that float64 holds
+    # exactly, and frexp returns its exponent
+    low = x & (~x + np.uint64(1))
+
+    return np.frexp(low.astype(np.float64))[1] - 1
+
+
+def min_shared_terms(bits: np.ndarray, rows: slice,
+                     cols: slice) -> np.ndarray:
+    '''Rank of the smallest term shared by each gene of 'rows' with each gene
+    of 'cols', or -1 when they share none. Words are scanned from the
+    smallest terms up, only over the genes with terms in each word, and
+    pairs are set by the first word they share.
+    '''
+
+    a, b = bits[rows], bits[cols]
+    result = np.full((len(a), len(b)), -1, dtype=np.int32)
+
+    for w in range(bits.shape[1]):
+        r = np.flatnonzero(a[:, w])
+        c = np.flatnonzero(b[:, w])
+        if not len(r) or not len(c):
+            continue
+
+        shared = a[r, w][:, None] & b[c, w][None, :]
+        block = result[np.ix_(r, c)]
+        new = (block < 0) & (shared != 0)
+        if new.any():
+            block[new] = w * 64 + lowest_bit(shared[new])
+            result[np.ix_(r, c)] = block
+
+    return result
+
+
+def min_shared_terms_sparse(matrix: sparse.csr_matrix, rows: slice,
+                            cols: slice,
+                            chunk_size: int = max_chunk) -> np.ndarray:
+    '''As min_shared_terms, from the incidence matrix: terms are taken in
+    chunks, smallest first, and weighted 2^-k (k the rank in the chunk), so
+    that in the sparse product A W B.T the exponent of each sum gives the
+    smallest shared term of the pair.
+    '''
+
+    chunk_size = min(chunk_size, max_chunk)
+    a = matrix[rows].astype(np.float64).tocsc()
+    b = matrix[cols].astype(np.float64).tocsc()
+    result = np.full((a.shape[0], b.shape[0]), -1, dtype=np.int32)
+
+    for t0 in range(0, matrix.shape[1], chunk_size):
+        t1 = min(t0 + chunk_size, matrix.shape[1])
+        a_chunk, b_chunk = a[:, t0:t1], b[:, t0:t1]
+        if not a_chunk.nnz or not b_chunk.nnz:
+            continue
+
+        # A sum of distinct 2^-k with smallest k is in [2^-k, 2^(1-k))
+        weights = sparse.diags(2. ** -np.arange(t1 - t0))
+        shared = (a_chunk @ weights @ b_chunk.T).tocoo()
+        k = 1 - np.frexp(shared.data)[1]
+
+        new = result[shared.row, shared.col] < 0
+        result[shared.row[new], shared.col[new]] = t0 + k[new]
+
+    return result
+
+
+def iter_shared_partners(matrix: sparse.csr_matrix) -> Iterator[tuple]:
+    '''Yields (gene, partners) for each gene (row of the incidence matrix),
+    with the genes after it that share at least one term with it, found
+    through the inverted index term -> genes (the matrix as CSC), so that
+    pairs sharing no term are never enumerated.
+    '''
+
+    by_term = matrix.tocsc()
+    by_term.sort_indices()
+    indptr, indices = by_term.indptr, by_term.indices
+
+    for gene in range(matrix.shape[0]):
+        partners = []
+        for t in matrix.indices[matrix.indptr[gene]:matrix.indptr[gene + 1]]:
+            term_genes = indices[indptr[t]:indptr[t + 1]]
+            # genes are sorted within a term: keep the ones after 'gene'
+            partners.append(term_genes[np.searchsorted(term_genes, gene,
+                                                       side='right'):])
+
+        if partners:
+            yield gene, np.unique(np.concatenate(partners))
+
+
+def iter_pairs(data: Union[np.ndarray, sparse.csr_matrix],
+               block_size: int = 512) -> Iterator[tuple]:
+    '''Yields (gene1, gene2, rank) arrays for all gene pairs (gene1 < gene2,
+    int32 codes), a block of gene1 at a time, with the rank of their
+    smallest shared term or -1. 'data' is either the bitsets of term_bits or
+    the incidence matrix.
+    '''
+
+    n_genes = data.shape[0]
+    min_shared = (min_shared_terms_sparse if sparse.issparse(data)
+                  else min_shared_terms)
+
+    for i0 in range(0, n_genes, block_size):
+        i1 = min(i0 + block_size, n_genes)
+        ranks = min_shared(data, slice(i0, i1), slice(i0, n_genes))
+        rows, cols = np.triu_indices(i1 - i0, k=1, m=n_genes - i0)
+
+        yield ((rows + i0).astype(np.int32), (cols + i0).astype(np.int32),
+               ranks[rows, cols])
+
+
+def shared_terms_of_pairs(matrix: sparse.csr_matrix, gene1: np.ndarray,
+                          gene2: np.ndarray) -> np.ndarray:
+    '''Rank of the smallest term shared by given pairs of genes (rows of the
+    incidence matrix), or -1, eg for the pairs of a correlation table: the
+    shared terms are the columns of the row products, smallest first.
+    '''
+
+    shared = matrix[gene1].multiply(matrix[gene2]).tocsr()
+    shared.eliminate_zeros()
+    shared.sort_indices()
+
+    rank = np.full(len(gene1), -1, dtype=np.int32)
+    found = np.diff(shared.indptr) > 0
+    rank[found] = shared.indices[shared.indptr[:-1][found]]
+
+    return rank
+
+
+def annot_codes(ont: pd.DataFrame, genes: List[str]) -> Iterator[np.ndarray]:
+    '''Yields the sorted codes (positions in 'genes') of the genes of each
+    term, from the 'annots' lists of the ontology (strings when read from
+    ontology.csv.gz), parsed as needed. Genes not in 'genes' are ignored.
+    '''
+
+    code = {gene: i for i, gene in enumerate(genes)}
+    for annots in ont['annots']:
+        if isinstance(annots, str):
+            annots = ast.literal_eval(annots)
+        yield np.unique(np.array([code[gene] for gene in annots
+                                  if gene in code], dtype=np.int32))
+
+
+def walk_terms(ont: pd.DataFrame, genes: List[str],
+               max_size: Optional[int] = None) -> Iterator[tuple]:
+    '''Yields (gene1, gene2, rank) arrays (int32 codes into 'genes' and ranks
+    into 'ont', sorted with sort_terms) term by term, from the smallest: the
+    pairs of genes annotated to each term that were not seen in a smaller
+    one, so each pair comes once, with its smallest shared term. Seen pairs
+    are bits of a genes x genes bit matrix. Stops after terms of 'max_size',
+    so work is proportional to the pairs sharing a specific term rather
+    than to all pairs.
+    '''
+
+    n_genes = len(genes)
+    seen = np.zeros((n_genes, (n_genes + 7) // 8), dtype=np.uint8)
+
+    for rank, (size, term_genes) in enumerate(zip(ont['size'],
+                                                  annot_codes(ont, genes))):
+        if max_size is not None and size > max_size:
+            break
+
+        rows, cols = np.triu_indices(len(term_genes), k=1)
+        gene1, gene2 = term_genes[rows], term_genes[cols]
+        byte, bit = gene2 >> 3, np.uint8(1) << (gene2 & 7).astype(np.uint8)
+
+        new = (seen[gene1, byte] & bit) == 0
+        if not new.any():
+            continue
+
+        gene1, gene2, byte, bit = gene1[new], gene2[new], byte[new], bit[new]
+        np.bitwise_or.at(seen, (gene1, byte), bit)
+
+        yield gene1, gene2, np.full(len(gene1), rank, dtype=np.int32)
+
+
+def specific_pairs(ont: pd.DataFrame, genes: List[str],
+                   max_size: Optional[int] = None) -> dict:
+    '''All pairs of walk_terms as arrays 'gene1', 'gene2' and 'term' (rank
+    into 'ont'), with their 'sem_sim' and 'term_size'.
+    '''
+
+    blocks = list(walk_terms(ont, genes, max_size))
+    if not blocks:
+        blocks = [(np.zeros(0, dtype=np.int32),) * 3]
+    gene1, gene2, rank = (np.concatenate(x) for x in zip(*blocks))
+
+    return {'gene1': gene1, 'gene2': gene2,
+            **similarity_arrays(rank, ont['size'].values)}
+
+
+def similarity_arrays(rank: np.ndarray, sizes: np.ndarray) -> dict:
+    '''Dense 'sem_sim' (2 / term size), 'term' (rank, -1 for none) and
+    'term_size' (inf for none) of pairs from the ranks of their smallest
+    shared terms and the sizes of the terms by rank.
+    '''
+
+    # rank -1 picks the appended inf size
+    size = np.append(np.asarray(sizes, dtype=np.float64), np.inf)[rank]
+
+    return {'sem_sim': 2 / size, 'term': rank, 'term_size': size}
+
+
+def semantic_similarity(ont: pd.DataFrame, gene_terms: Dict[str, List[str]],
+                        block_size: int = 512,
+                        verbose: bool = False) -> pd.DataFrame:
+    '''Semantic similarity of all gene pairs, as semantic_similarity in
+    semantic_similarity.py (2 / size of the smallest shared term), from the
+    term bitsets of the genes instead of a set intersection and an ontology
+    query per pair. Genes and terms are categoricals, and pairs without
+    shared terms have sem_sim 0, term_size inf and no term.
+    '''
+
+    ont = sort_terms(ont)
+    genes = list(gene_terms)
+    bits = term_bits(ont, gene_terms, genes)
+
+    gene1, gene2, rank = (np.concatenate(x) for x in
+                          zip(*iter_pairs(bits, block_size)))
+
+    if verbose:
+        print(f'{len(rank)} pairs: {(rank >= 0).sum()} with a shared term, '
+              f'{(rank < 0).sum()} without')
+
+    pairs = similarity_arrays(rank, ont['size'].values)
+    name_codes, names = pd.factorize(ont['name'])
+
+    return pd.DataFrame({
+        'gene1': pd.Categorical.from_codes(gene1, categories=genes),
+        'gene2': pd.Categorical.from_codes(gene2, categories=genes),
+        'sem_sim': pairs['sem_sim'],
+        'term': pd.Categorical.from_codes(rank, categories=ont['term_id']),
+        'term_size': pairs['term_size'],
+        'term_name': pd.Categorical.from_codes(
+            np.append(name_codes, -1)[rank], categories=names)})
+
+
+def write_pairs(pairs: Iterator[tuple], out_dir: str, genes: List[str],
+                ont: pd.DataFrame, row_group_size: int = 5_000_000,
+                verbose: bool = True) -> dict:
+    '''Streams (gene1, gene2, rank) blocks, from iter_pairs or walk_terms,
+    to 'out_dir'/pairs.parquet as int32 codes, in row groups, with the
+    gene symbols in genes.parquet (gene_id, gene) and the terms by rank in
+    terms.parquet (term, term_id, name, size), so that neither the pairs
+    table nor one string per row is built in memory. Only pairs sharing a
+    term are written: rows with rank -1 are dropped. Returns the number of
+    pairs written ('shared') and of the other pairs of 'genes', not written
+    ('not_shared': sem_sim 0 or, with walk_terms, sharing only terms above
+    the cutoff).
+    '''
+
+    os.makedirs(out_dir, exist_ok=True)
+    pd.DataFrame({'gene_id': np.arange(len(genes), dtype=np.int32),
+                  'gene': genes}).to_parquet(f'{out_dir}/genes.parquet')
+    terms = ont[['term_id', 'name', 'size']].reset_index(drop=True)
+    terms.insert(0, 'term', np.arange(len(terms), dtype=np.int32))
+    terms.to_parquet(f'{out_dir}/terms.parquet')
+
+    schema = pa.schema([('gene1', pa.int32()), ('gene2', pa.int32()),
+                        ('term', pa.int32())])
+    paths = {'shared': 0, 'not_shared': 0}
+
+    # Blocks (one per term with walk_terms) are buffered until they fill
+    # whole row groups, and the rest is written at the end
+    buffer, n_buffered = [], 0
+
+    def flush(writer: pq.ParquetWriter, last: bool) -> tuple:
+        table = pa.concat_tables(buffer)
+        n_rows = len(table) if last else (
+            len(table) // row_group_size * row_group_size)
+        if n_rows:
+            writer.write_table(table.slice(0, n_rows),
+                               row_group_size=row_group_size)
+        rest = table.slice(n_rows)
+
+        return ([rest] if len(rest) else []), len(rest)
+
+    # Written to a temporary file and renamed, so that a partial file is
+    # never mistaken for a complete one
+    tmp = f'{out_dir}/pairs.parquet.tmp'
+    with pq.ParquetWriter(tmp, schema, compression='snappy') as writer:
+        for gene1, gene2, rank in pairs:
+            shared = rank >= 0
+            if not shared.all():
+                gene1, gene2, rank = gene1[shared], gene2[shared], rank[shared]
+            buffer.append(pa.table([gene1, gene2, rank], schema=schema))
+            n_buffered += len(gene1)
+            paths['shared'] += len(gene1)
+            if n_buffered >= row_group_size:
+                buffer, n_buffered = flush(writer, last=False)
+        if buffer:
+            flush(writer, last=True)
+    os.replace(tmp, f'{out_dir}/pairs.parquet')
+
+    paths['not_shared'] = (len(genes) * (len(genes) - 1) // 2
+                           - paths['shared'])
+
+    if verbose:
+        size = os.path.getsize(f'{out_dir}/pairs.parquet') / 2**20
+        print(f'{paths["shared"]} pairs sharing a term written '
+              f'({size:.0f} MB), {paths["not_shared"]} other pairs not '
+              f'written')
+
+    return paths
+
+
+def write_semantic_similarity(ont: pd.DataFrame,
+                              gene_terms: Dict[str, List[str]],
+                              out_dir: str, block_size: int = 512,
+                              row_group_size: int = 5_000_000,
+                              verbose: bool = True) -> dict:
+    '''Semantic similarity of all gene pairs, as semantic_similarity, but
+    streamed block by block to 'out_dir' with write_pairs, which keeps only
+    pairs sharing a term. Genes without terms in 'ont' are left out before
+    pairs are enumerated, as none of their pairs do. Returns the counts of
+    write_pairs.
+    '''
+
+    ont = sort_terms(ont)
+    genes = list(gene_terms)
+    bits = term_bits(ont, gene_terms, genes)
+    annotated = np.flatnonzero(bits.any(axis=1)).astype(np.int32)
+
+    # Codes in the blocks of annotated genes back to codes in 'genes'
+    pairs = ((annotated[gene1], annotated[gene2], rank) for gene1, gene2, rank
+             in iter_pairs(bits[annotated], block_size))
+
+    return write_pairs(pairs, out_dir, genes, ont, row_group_size, verbose)
+
+
+def read_pairs(out_dir: str, filters: Optional[list] = None,
+               names: bool = True) -> pd.DataFrame:
+    '''Reads pairs written by write_pairs, optionally only rows matching
+    pyarrow 'filters' (eg [('term', '<', 1000)] for the smallest terms),
+    with 'sem_sim' (2 / term size) and 'term_size' from the terms table.
+    With 'names', genes and terms are categoricals of their symbols, ids
+    and names, as from semantic_similarity.
+    '''
+
+    pairs = pd.read_parquet(f'{out_dir}/pairs.parquet', filters=filters)
+    terms = pd.read_parquet(f'{out_dir}/terms.parquet')
+
+    rank = pairs['term'].values
+    arrays = similarity_arrays(rank, terms['size'].values)
+    pairs['sem_sim'] = arrays['sem_sim']
+    pairs['term_size'] = arrays['term_size']
+
+    if names:
+        genes = pd.read_parquet(f'{out_dir}/genes.parquet')['gene']
+        for col in ['gene1', 'gene2']:
+            pairs[col] = pd.Categorical.from_codes(pairs[col], genes)
+        name_codes, term_names = pd.factorize(terms['name'])
+        pairs['term_name'] = pd.Categorical.from_codes(
+            np.append(name_codes, -1)[rank], categories=term_names)
+        pairs['term'] = pd.Categorical.from_codes(rank, terms['term_id'])
+
+    return pairs
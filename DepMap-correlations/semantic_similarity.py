@@ -5,34 +5,43 @@ import numpy as np
 import multiprocessing as mp
 from itertools import combinations
 from functools import partial
+from corrtools.shared import shared_pool, get
+from gotools import semsim
+from corrtools.writer import read_tiles
 
 with open('processed_data/gene_terms.json') as json_file:
     gene_terms = json.load(json_file)
 
 genes = list(gene_terms.keys())
-gene_pairs = combinations(genes, 2)
 
 ont = pd.read_csv('processed_data/ontology.csv.gz')
 
 
-def semantic_similarity(pair, ont, gene_terms, count=[0]):
+def semantic_similarity(pair, ont, gene_terms, count=[0],
+                        paths={'no_shared': 0, 'not_in_ont': 0, 'shared': 0}):
     # as defined in https://www.nature.com/articles/s41467-019-13058-9#Sec9
+    # 'paths' counts pairs without shared terms, with shared terms missing
+    # from ont, and with a shared term (per process)
 
     if not count[0] % 50000:
-        print(count)
+        print(count, paths)
     count[0] += 1
 
     common_terms = (set(gene_terms.get(pair[0]))
                     .intersection(gene_terms.get(pair[1])))
+    if common_terms:
+        common_ont = ont.query('term_id in @common_terms')
 
-    if common_terms == {}:
+    # no shared terms, or none of them in ont
+    if not common_terms or common_ont.empty:
+        paths['not_in_ont' if common_terms else 'no_shared'] += 1
         sem_sim = 0
         min_term = 'None'
         min_num = np.inf
         min_name = 'None'
     else:
-        common_ont = (ont.query('term_id in @common_terms')
-                      .sort_values('size').iloc[0])
+        paths['shared'] += 1
+        common_ont = common_ont.sort_values('size').iloc[0]
 
         min_term = common_ont['term_id']
         min_num = common_ont['size']
@@ -41,23 +50,111 @@ def semantic_similarity(pair, ont, gene_terms, count=[0]):
 
     return *pair, sem_sim, min_term, min_num, min_name
 
+
+def term_ranks(ont: pd.DataFrame, gene_terms: dict, genes: list) -> tuple:
+    '''Returns the ontology sorted by term size and the terms of each gene as
+    CSR arrays (indptr, indices) of their ranks in it, sorted, so that the
+    smallest term shared by two genes is the first rank they share.
+    '''
+
+    ont = semsim.sort_terms(ont)
+    rank = pd.Series(ont.index, index=ont['term_id'])
+
+    ranks = [np.sort(rank.reindex(gene_terms[gene]).dropna()
+                     .values.astype(np.int32)) for gene in genes]
+    indptr = np.zeros(len(genes) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(r) for r in ranks])
+
+    return ont, indptr, np.concatenate(ranks)
+
+
+def min_shared_term(pair):
+    '''Rank of the smallest term shared by a pair of gene codes, or -1, from
+    the CSR arrays of term_ranks in shared memory.
+    '''
+
+    indptr, indices = get('indptr'), get('indices')
+    terms1 = indices[indptr[pair[0]]:indptr[pair[0] + 1]]
+    terms2 = indices[indptr[pair[1]]:indptr[pair[1] + 1]]
+    common = np.intersect1d(terms1, terms2, assume_unique=True)
+
+    return *pair, common[0] if len(common) else -1
+
+
 #%%
-partial_func = partial(semantic_similarity, ont=ont, gene_terms=gene_terms)
+# All pairs at once: terms sorted by size, genes as bitsets of their terms,
+# so the smallest term shared by two genes is the lowest set bit of a & b.
+# Pairs are streamed to disk as int codes, with genes.parquet and
+# terms.parquet side tables, instead of one string per row in memory. Only
+# pairs sharing a term are written; prints how many were and were not
+paths = semsim.write_semantic_similarity(ont, gene_terms,
+                                         'processed_data/sem-sim')
+
+# # %%
+# # Only pairs sharing a specific term (at most max_term_size genes), walking
+# # terms from the smallest, so work grows with those pairs rather than with
+# # all pairs. Int arrays: gene codes into genes and term ranks into
+# # ont_sorted
+# max_term_size = 500
+# ont_sorted = semsim.sort_terms(ont)
+# specific = semsim.specific_pairs(ont_sorted, genes, max_term_size)
+# # or straight to disk
+# semsim.write_pairs(semsim.walk_terms(ont_sorted, genes, max_term_size),
+#                    'processed_data/sem-sim-specific', genes, ont_sorted)
+
+# # %%
+# # Same from the sparse gene x term matrix of build_ontology.py, as dense
+# # arrays: gene codes into gene_terms_genes.parquet and term ranks (-1 for
+# # none) into gene_terms_terms.parquet
+# matrix, matrix_genes, terms = semsim.load_incidence('processed_data')
+# gene1, gene2, rank = (np.concatenate(x) for x in
+#                       zip(*semsim.iter_pairs(matrix)))
+# sem_sim = semsim.similarity_arrays(rank, terms['size'].values)
+
+# # Or only for the pairs of a correlation table, through gene codes
+# corr_genes = pd.read_parquet('processed_data/exp_corr/genes.parquet')
+# codes = pd.Index(matrix_genes).get_indexer(corr_genes['gene'])
+# exp_corr = read_tiles('processed_data/exp_corr',
+#                       columns=['gene1', 'gene2', 'corr'], gene_names=False)
+# g1, g2 = codes[exp_corr['gene1']], codes[exp_corr['gene2']]
+# annotated = (g1 >= 0) & (g2 >= 0)
+# rank = np.full(len(exp_corr), -1, dtype=np.int32)
+# rank[annotated] = semsim.shared_terms_of_pairs(matrix, g1[annotated],
+#                                                g2[annotated])
+# exp_corr = exp_corr.assign(**semsim.similarity_arrays(rank,
+#                                                       terms['size'].values))
+
+# # %%
+# # Pair by pair in a pool, with workers sharing the term ranks of each gene
+# # (a few int arrays) instead of a pickled copy of ont and gene_terms each
+# # Only pairs that share a term, from the inverted index term -> genes of
+# # the gene x term matrix: the others (sem_sim 0) are left out of the table
+# ont_sorted, indptr, indices = term_ranks(ont, gene_terms, genes)
+# matrix = semsim.incidence(ont_sorted, gene_terms, genes)
+# gene_pairs = ((gene, partner) for gene, partners
+#               in semsim.iter_shared_partners(matrix) for partner in partners)
+
+# cores = 30
+# with shared_pool(cores, indptr=indptr, indices=indices) as p:
+#     result = p.imap_unordered(min_shared_term, gene_pairs, chunksize=10000)
+#     result = np.array(list(result))
 
-cores = 30
-with mp.Pool(cores) as p:
-    result = p.imap_unordered(partial_func, gene_pairs, chunksize=10000)
-    result = list(result)
+# found = result[:, 2] >= 0
+# term = ont_sorted.iloc[np.where(found, result[:, 2], 0)]
 
-data = pd.DataFrame(result, columns=['gene1', 'gene2', 'sem_sim', 'term',
-                                     'term_size', 'term_name'])
-# data.to_parquet('processed_data/sem-sim.pq')
+# data = pd.DataFrame({
+#     'gene1': np.array(genes)[result[:, 0]],
+#     'gene2': np.array(genes)[result[:, 1]],
+#     'sem_sim': np.where(found, 2 / term['size'].values, 0),
+#     'term': np.where(found, term['term_id'].values, 'None'),
+#     'term_size': np.where(found, term['size'].values, np.inf),
+#     'term_name': np.where(found, term['name'].values, 'None')})
 
 
 
 # %%
 
-# data = pd.read_parquet('processed_data/sem-sim.pq')
+# data = semsim.read_pairs('processed_data/sem-sim')
 # data
 
 # # %%
@@ -71,13 +168,3 @@ data = pd.DataFrame(result, columns=['gene1', 'gene2', 'sem_sim', 'term',
 # sample_grouped.to_parquet('processed_data/sample-grouped_sem-sim.pq')
 
 # sample_grouped
-
-# %%
-
-from fastparquet import write
-write('processed_data/chunks_sem-sim.pq', data,
-      row_group_offsets=range(0, len(data), 5000000),
-      compression='SNAPPY', file_scheme='hive')
-
-# %%
-print(data)
@@ -0,0 +1,53 @@
+# %%
+import time
+import numpy as np
+import pandas as pd
+from instools.reader import chroms, compact_insertions
+
+n_insertions = 2_000_000
+n_screens = 20
+
+
+def synthetic_insertions(n: int, seed: int = 0) -> pd.DataFrame:
+    '''Returns a random insertions frame with the dtypes of read_insertions:
+    object chromosome and strand, int64 position.
+    '''
+
+    rng = np.random.default_rng(seed)
+    insertions = pd.DataFrame({
+        'chr': rng.choice(chroms[:-1], n).astype(object),
+        'pos': rng.integers(0, 150_000_000, n),
+        'strand': rng.choice(['+', '-'], n).astype(object)})
+
+    return insertions
+
+
+def memory_mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / 2**20
+
+
+# %%
+screens = [synthetic_insertions(n_insertions // n_screens, seed)
+           for seed in range(n_screens)]
+compact_screens = [compact_insertions(screen) for screen in screens]
+
+t0 = time.perf_counter()
+full = pd.concat(screens, ignore_index=True)
+t_full = time.perf_counter() - t0
+
+t0 = time.perf_counter()
+compact = pd.concat(compact_screens, ignore_index=True)
+t_compact = time.perf_counter() - t0
+
+# Shared dictionary keeps concatenated screens categorical
+assert isinstance(compact['chr'].dtype, pd.CategoricalDtype)
+assert (compact['chr'].astype(str).values == full['chr'].values).all()
+
+print(f'{n_insertions} insertions in {n_screens} screens')
+print(f'Object frame:  {memory_mb(full):7.1f} MB, concat {t_full:.3f} s')
+print(f'Compact frame: {memory_mb(compact):7.1f} MB, concat '
+      f'{t_compact:.3f} s ({memory_mb(full)/memory_mb(compact):.0f}x '
+      f'smaller)')
+print(compact.dtypes)
+
+# %%
@@ -0,0 +1,111 @@
+# %%
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from instools.reader import (read_insertions, read_insertions_full,
+                             reduce_insertions)
+from instools.store import write_store, read_store_region
+
+n_insertions = 5_000_000
+screen_name = 'SYNTHETIC'
+assembly = 'hg38'
+trim_length = 50
+
+# Region of roughly the size of a gene, eg CD274
+chrom, start, end = 'chr9', 5_450_502, 5_470_567
+n_repeats = 5
+
+chroms = [f'chr{x}' for x in list(range(1, 23)) + ['X', 'Y']]
+
+
+def synthetic_insertions(n: int, seed: int = 0) -> pd.DataFrame:
+    '''Returns a random insertions table with the layout of a screen's
+    insertions.parquet.snappy, sorted by chromosome and position.
+    '''
+
+    rng = np.random.default_rng(seed)
+    insertions = pd.DataFrame({
+        'chr': rng.choice(chroms, n),
+        'pos': rng.integers(0, 150_000_000, n),
+        'strand': rng.choice(['+', '-'], n),
+        'read_count': rng.integers(1, 100, n)})
+
+    return insertions.sort_values(['chr', 'pos']).reset_index(drop=True)
+
+
+def time_it(func, *args, **kwargs) -> tuple:
+
+    times = []
+    for _ in range(n_repeats):
+        t0 = time.perf_counter()
+        result = func(*args, **kwargs)
+        times.append(time.perf_counter() - t0)
+
+    return np.median(times), result
+
+
+# %%
+tmp_dir = tempfile.mkdtemp()
+data_path = f'{tmp_dir}/{screen_name}/{assembly}/{trim_length}/'
+
+insertions = synthetic_insertions(n_insertions)
+pa_table = pa.Table.from_pandas(insertions, preserve_index=False)
+
+os.makedirs(data_path)
+pq.write_table(pa_table, f'{data_path}insertions.parquet.snappy',
+               compression='snappy', row_group_size=100_000)
+
+# %%
+t_full, full = time_it(read_insertions_full, tmp_dir, screen_name, chrom,
+                       start, end)
+t_push, push = time_it(read_insertions, tmp_dir, screen_name, chrom, start,
+                       end)
+t_cols, cols = time_it(read_insertions, tmp_dir, screen_name, chrom, start,
+                       end, columns=['chr', 'pos'])
+
+assert len(full) == len(push) == len(cols)
+assert (full['pos'].values == push['pos'].values).all()
+
+print(f'{n_insertions} insertions, {len(full)} in {chrom}:{start}-{end}')
+print(f'Full read + query:     {t_full:.3f} s')
+print(f'Pushdown filters:      {t_push:.3f} s ({t_full/t_push:.0f}x)')
+print(f'Pushdown + chr/pos:    {t_cols:.3f} s ({t_full/t_cols:.0f}x)')
+
+# %%
+# Chromosome-partitioned store with binary search over row groups
+t0 = time.perf_counter()
+write_store(tmp_dir, screen_name, assembly, trim_length)
+t_write = time.perf_counter() - t0
+
+t_store, store = time_it(read_store_region, tmp_dir, screen_name, chrom,
+                         start, end)
+
+assert (full['pos'].values == store['pos'].values).all()
+
+print(f'Store conversion:      {t_write:.3f} s (once per screen)')
+print(f'Partitioned store:     {t_store:.3f} s ({t_full/t_store:.0f}x)')
+
+# %%
+# Streaming aggregation in bounded memory: insertions per chromosome
+def count_chroms(counts: pd.Series, batch: pd.DataFrame) -> pd.Series:
+    return counts.add(batch['chr'].value_counts(), fill_value=0)
+
+
+t0 = time.perf_counter()
+chrom_counts, peak = reduce_insertions(count_chroms, pd.Series(dtype=float),
+                                       tmp_dir, screen_name,
+                                       columns=['chr'], batch_size=500_000)
+t_stream = time.perf_counter() - t0
+
+assert chrom_counts.sum() == n_insertions
+print(f'Streaming count:       {t_stream:.3f} s, peak batch '
+      f'{peak["batch_mb"]:.0f} MB vs full frame '
+      f'{insertions.memory_usage(deep=True).sum() / 2**20:.0f} MB')
+
+# %%
+shutil.rmtree(tmp_dir)
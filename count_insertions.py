@@ -0,0 +1,48 @@
+# %%
+from instools.refseq import load_refseq
+from instools.exons import load_exon_table
+from instools.aggregate import (feature_count_matrix, bin_count_matrix,
+                                genome_bins)
+
+screen_type = 'ip'  # 'ip', 'pa'
+screen_names = ['ABC-WNT']
+bin_size = 10_000
+
+data_path = '/media/data/nas_scratch/guizela/data'
+
+# Data directories
+if screen_type == 'ip':
+    ins_dir = f'{data_path}/screen-insertions'
+elif screen_type == 'pa':
+    ins_dir = f'{data_path}/screen-insertions_activating'
+refseq_dir = f'{data_path}/refseq-processed'
+
+hg38_sizes = {'chr1': 248956422, 'chr2': 242193529, 'chr3': 198295559,
+              'chr4': 190214555, 'chr5': 181538259, 'chr6': 170805979,
+              'chr7': 159345973, 'chr8': 145138636, 'chr9': 138394717,
+              'chr10': 133797422, 'chr11': 135086622, 'chr12': 133275309,
+              'chr13': 114364328, 'chr14': 107043718, 'chr15': 101991189,
+              'chr16': 90338345, 'chr17': 83257441, 'chr18': 80373285,
+              'chr19': 58617616, 'chr20': 64444167, 'chr21': 46709983,
+              'chr22': 50818468, 'chrX': 156040895, 'chrY': 57227415}
+
+# %%
+# Insertions per gene, in sense and antisense orientation
+genes = load_refseq(refseq_dir).positions
+gene_counts = feature_count_matrix(ins_dir, screen_names, genes,
+                                   by_strand=True)
+gene_counts
+
+# %%
+# Insertions per exon region (CDS/UTR pieces of get_exon_regions)
+exon_table = load_exon_table(refseq_dir)
+exon_counts = feature_count_matrix(ins_dir, screen_names, exon_table)
+exon_counts
+
+# %%
+# Insertions per fixed-size genomic bin
+bins = genome_bins(hg38_sizes, bin_size)
+bin_counts = bin_count_matrix(ins_dir, screen_names, hg38_sizes, bin_size)
+bin_counts
+
+# %%
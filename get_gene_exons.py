@@ -2,6 +2,8 @@
 import pandas as pd
 from itertools import groupby
 from operator import itemgetter
+from instools.refseq import load_refseq
+from instools.exons import exon_regions, load_exon_table
 
 gene = 'CD274'
 data_path = '/media/data/nas_scratch/guizela/data'
@@ -73,10 +75,31 @@ def get_exon_regions(refseq: pd.DataFrame, gene: str) -> pd.DataFrame:
     return exon_regions
 
 
-refseq = pd.read_parquet(f'{refseq_dir}/ncbi-genes-hg38.parquet.snappy',
-                         engine='pyarrow').query('coding == True and '
-                                                 'known == True')
-exons = get_exon_regions(refseq, gene)
+# Parsed once per session, then gene lookups use the symbol index
+refseq = load_refseq(refseq_dir)
+exons = get_exon_regions(refseq.transcripts(gene), gene)
 exons
 
 # %%
+# Exon regions of all genes at once, by interval arithmetic on exon and cds
+# limits instead of per-base lists
+all_exons = exon_regions(refseq.refseq)
+all_exons
+
+# %%
+# Check that both give the same regions on a sample of genes
+sample_genes = refseq.positions.sample(200, random_state=0).index
+for sample_gene in sample_genes:
+    pd.testing.assert_frame_equal(
+        get_exon_regions(refseq.transcripts(sample_gene), sample_gene),
+        all_exons.query('name2 == @sample_gene').reset_index(drop=True))
+print(f'Same exon regions for {len(sample_genes)} genes')
+
+# %%
+# Genome-wide exon region table, cached on disk next to the refseq file and
+# rebuilt only when that file changes
+exon_table = load_exon_table(refseq_dir)
+gene_exons = load_exon_table(refseq_dir, gene=gene)
+gene_exons
+
+# %%
@@ -0,0 +1,16 @@
+from . import overlap
+from . import store
+from . import reader
+from . import refseq
+from . import batch
+from . import exons
+from . import aggregate
+
+from importlib import reload
+reload(overlap)
+reload(store)
+reload(reader)
+reload(refseq)
+reload(batch)
+reload(exons)
+reload(aggregate)
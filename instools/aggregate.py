@@ -0,0 +1,187 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import multiprocessing as mp
+from functools import partial
+from typing import Dict, Iterator, List
+
+from .overlap import normalize_chrom
+from .reader import iter_insertions
+from .store import has_store, read_index, store_path
+
+
+def iter_chromosomes(data_dir: str, screen_name: str, columns: List[str],
+                     assembly: str = 'hg38',
+                     trim_length: int = 50) -> Iterator[tuple]:
+    '''Yields (chrom, insertions sorted by position) for one chromosome of a
+    screen at a time, reading only 'columns'. Uses the partitioned store if
+    there is one, which is already sorted, and otherwise reads the flat file
+    in a single pass.
+    '''
+
+    columns = [c for c in columns if c != 'chr']
+
+    if has_store(data_dir, screen_name, assembly, trim_length):
+        path = store_path(data_dir, screen_name, assembly, trim_length)
+        for chrom in read_index(path):
+            table = pq.read_table(f'{path}/chr={chrom}/'
+                                  f'insertions.parquet.snappy',
+                                  columns=columns)
+            yield chrom, table.to_pandas()
+    else:
+        # The flat file is not grouped by chromosome: one pass over it,
+        # bucketing rows by chromosome, holds 'columns' of the whole screen
+        # in memory (rather than one chromosome), but reads the file once
+        # instead of once per chromosome
+        buckets = {}
+        for batch in iter_insertions(data_dir, screen_name, assembly=assembly,
+                                     trim_length=trim_length,
+                                     columns=['chr'] + columns):
+            for chrom, rows in batch.groupby('chr', sort=False,
+                                             observed=True):
+                buckets.setdefault(chrom, []).append(rows[columns])
+        for chrom in sorted(buckets):
+            insertions = pd.concat(buckets.pop(chrom), ignore_index=True)
+            yield chrom, insertions.sort_values(
+                'pos', kind='stable').reset_index(drop=True)
+
+
+def count_in_features(pos: np.ndarray, starts: np.ndarray,
+                      ends: np.ndarray) -> np.ndarray:
+    '''Returns the number of sorted positions in each half-open feature
+    [start, end), by binary search (features may overlap).
+    '''
+
+    counts = (np.searchsorted(pos, ends, side='left')
+              - np.searchsorted(pos, starts, side='left'))
+
+    return np.maximum(counts, 0).astype(np.uint32)
+
+
+def count_features(screen_name: str, data_dir: str, features: pd.DataFrame,
+                   start_col: str = 'start', end_col: str = 'end',
+                   by_strand: bool = False, assembly: str = 'hg38',
+                   trim_length: int = 50) -> np.ndarray:
+    '''Returns insertion counts of one screen in each feature (refseq genes,
+    exon regions, BED intervals, ...), in one pass over the screen, one
+    chromosome at a time. With 'by_strand', returns a (2, features) array
+    with counts of insertions in the same ('sense') and the opposite
+    ('antisense') orientation as the feature 'strand'.
+    '''
+
+    feat_chrom = normalize_chrom(features['chrom']).values
+    starts = features[start_col].values
+    ends = features[end_col].values
+
+    counts = np.zeros((2 if by_strand else 1, len(features)), dtype=np.uint32)
+
+    columns = ['pos', 'strand'] if by_strand else ['pos']
+    for chrom, insertions in iter_chromosomes(data_dir, screen_name, columns,
+                                              assembly, trim_length):
+        idx = np.flatnonzero(feat_chrom == chrom)
+        if not len(idx):
+            continue
+
+        if not by_strand:
+            counts[0, idx] = count_in_features(insertions['pos'].values,
+                                               starts[idx], ends[idx])
+            continue
+
+        feat_plus = features['strand'].values[idx] == '+'
+        ins_plus = insertions['strand'].values == '+'
+        plus = count_in_features(insertions['pos'].values[ins_plus],
+                                 starts[idx], ends[idx])
+        minus = count_in_features(insertions['pos'].values[~ins_plus],
+                                  starts[idx], ends[idx])
+        counts[0, idx] = np.where(feat_plus, plus, minus)
+        counts[1, idx] = np.where(feat_plus, minus, plus)
+
+    return counts if by_strand else counts[0]
+
+
+def genome_bins(chrom_sizes: Dict[str, int], bin_size: int) -> pd.DataFrame:
+    '''Returns fixed-size genomic bins as a BED-like frame, in the same order
+    as the counts of count_bins.
+    '''
+
+    bins = []
+    for chrom, size in chrom_sizes.items():
+        starts = np.arange(0, size, bin_size)
+        bins.append(pd.DataFrame({'chrom': chrom, 'start': starts,
+                                  'end': np.minimum(starts + bin_size,
+                                                    size)}))
+
+    return pd.concat(bins, ignore_index=True)
+
+
+def count_bins(screen_name: str, data_dir: str, chrom_sizes: Dict[str, int],
+               bin_size: int, assembly: str = 'hg38',
+               trim_length: int = 50) -> np.ndarray:
+    '''Returns insertion counts of one screen in the bins of genome_bins,
+    with np.bincount on each chromosome. Chromosomes missing from
+    'chrom_sizes' are skipped.
+    '''
+
+    n_bins = {chrom: -(-size // bin_size)
+              for chrom, size in chrom_sizes.items()}
+    offsets = dict(zip(n_bins, np.cumsum([0] + list(n_bins.values()))))
+
+    counts = np.zeros(sum(n_bins.values()), dtype=np.uint32)
+    for chrom, insertions in iter_chromosomes(data_dir, screen_name, ['pos'],
+                                              assembly, trim_length):
+        if chrom not in n_bins:
+            continue
+        pos = insertions['pos'].values
+        pos = pos[(pos >= 0) & (pos < chrom_sizes[chrom])]
+        counts[offsets[chrom]:offsets[chrom] + n_bins[chrom]] = np.bincount(
+            pos // bin_size, minlength=n_bins[chrom])
+
+    return counts
+
+
+def feature_count_matrix(data_dir: str, screen_names: List[str],
+                         features: pd.DataFrame, start_col: str = 'start',
+                         end_col: str = 'end', by_strand: bool = False,
+                         assembly: str = 'hg38', trim_length: int = 50,
+                         cores: int = 4) -> pd.DataFrame:
+    '''Returns a screen x feature matrix of insertion counts (uint32), with
+    the features index as columns. With 'by_strand', columns are a
+    ('sense'/'antisense', feature) MultiIndex. Screens are counted in
+    parallel.
+    '''
+
+    partial_func = partial(count_features, data_dir=data_dir,
+                           features=features, start_col=start_col,
+                           end_col=end_col, by_strand=by_strand,
+                           assembly=assembly, trim_length=trim_length)
+
+    with mp.Pool(min(cores, len(screen_names))) as p:
+        result = p.map(partial_func, screen_names)
+
+    if by_strand:
+        columns = pd.MultiIndex.from_product([['sense', 'antisense'],
+                                              features.index])
+        result = [r.ravel() for r in result]
+    else:
+        columns = features.index
+
+    return pd.DataFrame(np.vstack(result), index=screen_names,
+                        columns=columns)
+
+
+def bin_count_matrix(data_dir: str, screen_names: List[str],
+                     chrom_sizes: Dict[str, int], bin_size: int,
+                     assembly: str = 'hg38', trim_length: int = 50,
+                     cores: int = 4) -> pd.DataFrame:
+    '''Returns a screen x bin matrix of insertion counts (uint32). Columns
+    are the rows of genome_bins(chrom_sizes, bin_size).
+    '''
+
+    partial_func = partial(count_bins, data_dir=data_dir,
+                           chrom_sizes=chrom_sizes, bin_size=bin_size,
+                           assembly=assembly, trim_length=trim_length)
+
+    with mp.Pool(min(cores, len(screen_names))) as p:
+        result = p.map(partial_func, screen_names)
+
+    return pd.DataFrame(np.vstack(result), index=screen_names)
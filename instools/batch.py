@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+from functools import partial
+from typing import List, Optional
+
+from .reader import convert_position, insertions_path
+from .refseq import RefSeq
+from .overlap import expand_ranges, position_keys
+from .store import has_store, read_store_regions
+
+
+def merge_intervals(intervals: pd.DataFrame) -> pd.DataFrame:
+    '''Sorts intervals ('chrom', 'start', 'end', both ends included as in
+    read_insertions) and merges the ones that overlap or touch.
+    '''
+
+    ivs = intervals[['chrom', 'start', 'end']].sort_values(['chrom', 'start'])
+
+    merged = []
+    for chrom, group in ivs.groupby('chrom', sort=True):
+        starts = group['start'].values
+        ends = np.maximum.accumulate(group['end'].values)
+        new = np.r_[True, starts[1:] > ends[:-1] + 1]
+        first = np.flatnonzero(new)
+        last = np.r_[first[1:], len(starts)] - 1
+        merged.append(pd.DataFrame({'chrom': chrom, 'start': starts[first],
+                                    'end': ends[last]}))
+
+    if not merged:
+        return pd.DataFrame(columns=['chrom', 'start', 'end'])
+
+    return pd.concat(merged, ignore_index=True)
+
+
+def position_intervals(positions: List[str]) -> pd.DataFrame:
+
+    intervals = pd.DataFrame([convert_position(p) for p in positions],
+                             columns=['chrom', 'start', 'end'])
+    intervals.insert(0, 'name', positions)
+
+    return intervals
+
+
+def read_screen_intervals(screen_name: str, data_dir: str,
+                          intervals: pd.DataFrame, assembly: str = 'hg38',
+                          trim_length: int = 50,
+                          columns: Optional[List[str]] = None
+                          ) -> pd.DataFrame:
+    '''Returns insertions of one screen in all intervals, tagged with the
+    interval 'name'. The screen is read once, for the merged intervals, and
+    rows are then assigned to the original (possibly overlapping) intervals.
+    '''
+
+    read_cols = None
+    if columns is not None:
+        read_cols = list(dict.fromkeys(['chr', 'pos'] + columns))
+
+    merged = merge_intervals(intervals)
+
+    try:
+        if has_store(data_dir, screen_name, assembly, trim_length):
+            insertions = read_store_regions(data_dir, screen_name, merged,
+                                            assembly, trim_length, read_cols)
+        else:
+            # One clause per interval makes pyarrow evaluate every clause on
+            # every row: filter on chromosomes only, positions are selected
+            # below by binary search
+            filters = [('chr', 'in', list(merged['chrom'].unique()))]
+            filename = insertions_path(data_dir, screen_name, assembly,
+                                       trim_length)
+            insertions = pd.read_parquet(filename, engine='pyarrow',
+                                         columns=read_cols, filters=filters)
+    except FileNotFoundError:
+        print(f'!! Error: no file found for screen {screen_name}')
+        return None
+
+    # Assign rows to intervals by binary search on (chromosome, position)
+    chroms = np.unique(insertions['chr'].values)
+    ins_key = position_keys(insertions['chr'], insertions['pos'], chroms)
+    order = np.argsort(ins_key, kind='stable')
+    ins_key = ins_key[order]
+
+    start_key = position_keys(intervals['chrom'], intervals['start'], chroms)
+    end_key = position_keys(intervals['chrom'], intervals['end'], chroms)
+    lo = np.searchsorted(ins_key, start_key, side='left')
+    hi = np.searchsorted(ins_key, end_key, side='right')
+    hi[start_key < 0] = lo[start_key < 0]
+
+    rows, owner = expand_ranges(lo, hi)
+    insertions = insertions.iloc[order[rows]].reset_index(drop=True)
+    insertions.insert(0, 'name', intervals['name'].values[owner])
+    if columns is not None:
+        insertions = insertions[['name'] + columns]
+
+    return insertions
+
+
+def get_insertions_batch(data_dir: str, screen_names: List[str],
+                         genes: Optional[List[str]] = None,
+                         positions: Optional[List[str]] = None,
+                         refseq: Optional[RefSeq] = None,
+                         assembly: str = 'hg38', trim_length: int = 50,
+                         columns: Optional[List[str]] = None,
+                         cores: int = 4) -> pd.DataFrame:
+    '''Returns insertions for many genes (looked up in 'refseq', as returned
+    by refseq.load_refseq) and/or positions (eg 'chr9:5,450,503-5,470,567')
+    in many screens, as one long dataframe tagged with 'screen' and interval
+    'name'. Screens are read in parallel, each of them once.
+    '''
+
+    intervals = []
+    if genes is not None:
+        if refseq is None:
+            raise ValueError('refseq is needed to select by gene')
+        intervals.append(refseq.intervals(genes))
+    if positions is not None:
+        intervals.append(position_intervals(positions))
+    if not intervals:
+        raise ValueError('no genes or positions were provided')
+
+    intervals = pd.concat(intervals, ignore_index=True)
+
+    partial_func = partial(read_screen_intervals, data_dir=data_dir,
+                           intervals=intervals, assembly=assembly,
+                           trim_length=trim_length, columns=columns)
+
+    result = []
+    if screen_names:
+        with mp.Pool(min(cores, len(screen_names))) as p:
+            result = p.map(partial_func, screen_names)
+
+    found = [ins.assign(screen=screen) for screen, ins
+             in zip(screen_names, result) if ins is not None]
+
+    # No screen has a file: an empty frame with the requested columns (or
+    # the known 'chr' and 'pos' when all columns were asked for)
+    if not found:
+        print('!! Warning: no insertions found for any screen')
+        cols = columns if columns is not None else ['chr', 'pos']
+        return pd.DataFrame(columns=['name'] + cols + ['screen'])
+
+    return pd.concat(found, ignore_index=True)
@@ -0,0 +1,174 @@
+import os
+import glob
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from typing import List, Optional
+
+from .reader import read_refseq
+
+region_columns = ['name2', 'chrom', 'name', 'exon_id', 'tx_id',
+                  'region_type', 'start', 'end']
+
+
+def split_coords(coords: pd.Series) -> tuple:
+    '''Parses comma-separated coordinates ('exonStarts', 'exonEnds') of all
+    transcripts at once. Returns the coordinates and the row each one comes
+    from.
+    '''
+
+    coords = coords.str.split(',').explode()
+    coords = coords[coords.notna() & (coords != '')]
+
+    return coords.values.astype(np.int64), coords.index.values
+
+
+def exon_regions(refseq: pd.DataFrame,
+                 genes: Optional[List[str]] = None) -> pd.DataFrame:
+    '''Returns start and end positions of the CDS and UTR parts of the exons
+    of all genes in refseq (or only of 'genes'), with the same columns, ids
+    and order as get_exon_regions in get_gene_exons.py. Eg.:
+    name2	chrom	name	        exon_id	tx_id	region_type	start	end
+    CD274	chr9	NM_001267706.1	1	    1	    UTR	        5450502	5450596
+    CD274	chr9	NM_001267706.1	2	    1	    UTR	        5456099	5456113
+    CD274	chr9	NM_001267706.1	2	    1	    CDS	        5456113	5456165
+
+    Exons are split by clipping their ends against cdsStart/cdsEnd for all
+    transcripts at once, so cost does not depend on exon length. 'tx_id' and
+    'exon_id' count transcripts and exons within each gene, in refseq order.
+    '''
+
+    if genes is not None:
+        refseq = refseq[refseq['name2'].isin(genes)]
+    tx = refseq.reset_index(drop=True)
+
+    tx_id = tx.groupby('name2', sort=False).cumcount().values + 1
+
+    starts, tx_row = split_coords(tx['exonStarts'])
+    ends, end_row = split_coords(tx['exonEnds'])
+    if not np.array_equal(tx_row, end_row):
+        raise ValueError('exonStarts and exonEnds have different lengths')
+
+    # Exons are numbered across all transcripts of a gene
+    gene_code = pd.factorize(tx['name2'])[0][tx_row]
+    exon_id = pd.Series(gene_code).groupby(gene_code).cumcount().values + 1
+
+    cds_start = tx['cdsStart'].values[tx_row]
+    cds_end = tx['cdsEnd'].values[tx_row]
+    coding = cds_start < cds_end
+
+    # Exons of non-coding transcripts are a single UTR piece
+    cds_lo = np.maximum(starts, cds_start)
+    cds_hi = np.minimum(ends, cds_end)
+    utr5_hi = np.where(coding, np.minimum(ends, cds_start), ends)
+    utr3_lo = np.where(coding, np.maximum(starts, cds_end), ends)
+
+    pieces = [('CDS', cds_lo, cds_hi, coding),
+              ('UTR', starts, utr5_hi, True),
+              ('UTR', utr3_lo, ends, coding)]
+
+    regions = []
+    for region_type, lo, hi, valid in pieces:
+        keep = np.flatnonzero(valid & (lo < hi))
+        rows = tx_row[keep]
+        regions.append(pd.DataFrame({
+            'name2': tx['name2'].values[rows],
+            'chrom': tx['chrom'].values[rows],
+            'name': tx['name'].values[rows],
+            'exon_id': exon_id[keep],
+            'tx_id': tx_id[rows],
+            'region_type': region_type,
+            'start': lo[keep],
+            'end': hi[keep],
+            'gene_code': gene_code[keep]}))
+
+    regions = pd.concat(regions, ignore_index=True)
+    regions = regions.sort_values(['gene_code', 'tx_id', 'exon_id', 'start'],
+                                  kind='stable')
+
+    return regions[region_columns].reset_index(drop=True)
+
+
+def refseq_key(data_dir: str, assembly: str = 'hg38',
+               coding_only: bool = True, known_only: bool = True) -> str:
+    '''Returns a key that changes whenever the refseq parquet file changes
+    (modification time and size) or other filters are used.
+    '''
+
+    stat = os.stat(f'{data_dir}/ncbi-genes-{assembly}.parquet.snappy')
+
+    return (f'{assembly}-coding{int(bool(coding_only))}'
+            f'-known{int(bool(known_only))}'
+            f'-{stat.st_mtime_ns}-{stat.st_size}')
+
+
+def build_exon_table(data_dir: str, assembly: str = 'hg38',
+                     coding_only: bool = True, known_only: bool = True,
+                     cache_dir: Optional[str] = None) -> str:
+    '''Computes exon regions of all refseq genes and writes them, sorted by
+    chromosome and position, to 'cache_dir' (by default 'exon-regions' in the
+    refseq directory). The file is named after refseq_key, and files built
+    from older versions of the refseq file are removed. Returns the path.
+    '''
+
+    if cache_dir is None:
+        cache_dir = f'{data_dir}/exon-regions'
+    os.makedirs(cache_dir, exist_ok=True)
+
+    key = refseq_key(data_dir, assembly, coding_only, known_only)
+    filename = f'{cache_dir}/exon-regions-{key}.parquet.snappy'
+
+    refseq = read_refseq(data_dir, assembly, coding_only, known_only)
+    regions = exon_regions(refseq)
+    regions = regions.sort_values(['chrom', 'start', 'end'], kind='stable')
+    regions.reset_index(drop=True).to_parquet(filename, compression='snappy',
+                                              row_group_size=100_000)
+
+    # Remove tables of previous versions of the refseq file
+    prefix = key.rsplit('-', 2)[0]
+    for old in glob.glob(f'{cache_dir}/exon-regions-{prefix}-*'):
+        if old != filename:
+            os.remove(old)
+
+    return filename
+
+
+@lru_cache(maxsize=4)
+def read_exon_table(filename: str) -> tuple:
+    '''Reads an exon table once per process. Returns the table and the rows
+    of each gene.
+    '''
+
+    table = pd.read_parquet(filename)
+
+    return table, table.groupby('name2', sort=False).indices
+
+
+def load_exon_table(data_dir: str, assembly: str = 'hg38',
+                    gene: Optional[str] = None, coding_only: bool = True,
+                    known_only: bool = True,
+                    cache_dir: Optional[str] = None) -> pd.DataFrame:
+    '''Returns the genome-wide exon region table, or only the regions of
+    'gene' in the same order as get_exon_regions. The table is built with
+    build_exon_table only if there is none for the current refseq file.
+    '''
+
+    if cache_dir is None:
+        cache_dir = f'{data_dir}/exon-regions'
+
+    key = refseq_key(data_dir, assembly, coding_only, known_only)
+    filename = f'{cache_dir}/exon-regions-{key}.parquet.snappy'
+    if not os.path.exists(filename):
+        print(f'Building exon region table for {assembly}')
+        build_exon_table(data_dir, assembly, coding_only, known_only,
+                         cache_dir)
+
+    table, rows = read_exon_table(filename)
+
+    if gene is None:
+        return table
+
+    regions = table.iloc[rows.get(gene, [])]
+    regions = regions.sort_values(['tx_id', 'exon_id', 'start'])
+
+    return regions.reset_index(drop=True)
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+from typing import List, Optional
+
+bed_columns = ['chrom', 'start', 'end', 'name', 'score', 'strand']
+
+
+def expand_ranges(lo: np.ndarray, hi: np.ndarray) -> tuple:
+    '''Returns the concatenation of range(lo[i], hi[i]) for all i, together
+    with the i each element comes from, without a Python loop.
+    '''
+
+    counts = np.maximum(hi - lo, 0)
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                  counts)
+
+    return np.repeat(lo, counts) + offsets, owner
+
+
+def position_keys(chrom: pd.Series, pos: pd.Series,
+                  chroms: np.ndarray) -> np.ndarray:
+    '''Returns int64 keys that sort like (chromosome, position), with
+    chromosomes coded by their index in 'chroms'. Chromosomes not in 'chroms'
+    get negative keys.
+    '''
+
+    codes = pd.Categorical(chrom, categories=chroms).codes.astype(np.int64)
+    keys = (codes << 32) + np.clip(np.asarray(pos, dtype=np.int64), 0, None)
+    keys[codes < 0] = -1
+
+    return keys
+
+
+def normalize_chrom(chrom: pd.Series) -> pd.Series:
+    '''Adds the 'chr' prefix used in insertion files to chromosome names that
+    lack it, eg the BED files written by map_motifs.py ('9' -> 'chr9').
+    '''
+
+    chrom = chrom.astype(str)
+
+    return chrom.where(chrom.str.startswith('chr'), 'chr' + chrom)
+
+
+def read_bed(filename: str) -> pd.DataFrame:
+    '''Reads a headerless BED file (0-based, half-open), as written by
+    map_motifs.py.
+    '''
+
+    bed = pd.read_csv(filename, sep='\t', header=None)
+    bed = bed.rename(columns=dict(enumerate(bed_columns)))
+    bed['chrom'] = normalize_chrom(bed['chrom'])
+
+    return bed
+
+
+def overlap_join(insertions: pd.DataFrame, features: pd.DataFrame,
+                 start_col: str = 'start',
+                 end_col: str = 'end') -> pd.DataFrame:
+    '''Returns all (insertion, feature) pairs where the insertion falls in the
+    feature, as a dataframe with the index labels of both frames in columns
+    'insertion' and 'feature'.
+
+    Features are any BED-like frame with a 'chrom' column (refseq genes with
+    start_col='txStart' and end_col='txEnd', get_exon_regions output, BED
+    files from read_bed). Their coordinates are taken as 0-based half-open,
+    like the output of convert_position, so an insertion at 'pos' is in a
+    feature if start <= pos < end.
+
+    Insertions are sorted once by (chromosome, position), and each feature
+    gets its slice of insertions by binary search, so cost is
+    O((insertions + features) log insertions + pairs), and features may
+    overlap each other.
+    '''
+
+    chroms = np.unique(insertions['chr'].values)
+    ins_key = position_keys(insertions['chr'], insertions['pos'], chroms)
+    order = np.argsort(ins_key, kind='stable')
+    ins_key = ins_key[order]
+
+    feat_chrom = normalize_chrom(features['chrom'])
+    start_key = position_keys(feat_chrom, features[start_col], chroms)
+    end_key = position_keys(feat_chrom, features[end_col], chroms)
+
+    lo = np.searchsorted(ins_key, start_key, side='left')
+    hi = np.searchsorted(ins_key, end_key, side='left')
+    hi[start_key < 0] = lo[start_key < 0]
+
+    rows, owner = expand_ranges(lo, hi)
+
+    return pd.DataFrame({'insertion': insertions.index.values[order[rows]],
+                         'feature': features.index.values[owner]})
+
+
+def annotate_insertions(insertions: pd.DataFrame, features: pd.DataFrame,
+                        feature_cols: Optional[List[str]] = None,
+                        start_col: str = 'start',
+                        end_col: str = 'end') -> pd.DataFrame:
+    '''Returns insertions with the columns 'feature_cols' of the features they
+    fall in. Insertions in several features are repeated, one row per
+    feature, and insertions outside all features are dropped.
+    '''
+
+    insertions = insertions.reset_index(drop=True)
+    features = features.reset_index(drop=True)
+    pairs = overlap_join(insertions, features, start_col, end_col)
+
+    if feature_cols is None:
+        feature_cols = [c for c in features.columns
+                        if c not in insertions.columns]
+
+    annotated = insertions.iloc[pairs['insertion']].reset_index(drop=True)
+    annotated[feature_cols] = (features.iloc[pairs['feature']][feature_cols]
+                               .reset_index(drop=True))
+
+    return annotated
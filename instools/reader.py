@@ -0,0 +1,209 @@
+import resource
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from typing import Any, Callable, Iterator, List, Optional
+
+from .store import has_store, read_store_region
+
+# Shared chromosome dictionary of compact insertion frames, the same for all
+# screens so that they can be concatenated without re-encoding. Contigs
+# outside it (unplaced, alt, ...) share the last, reserved 'other' category
+chroms = [f'chr{x}' for x in list(range(1, 23)) + ['X', 'Y', 'M']]
+other_chrom = 'other'
+chrom_dtype = pd.CategoricalDtype(categories=chroms + [other_chrom],
+                                  ordered=True)
+
+
+def insertions_path(data_dir: str, screen_name: str, assembly: str = 'hg38',
+                    trim_length: int = 50) -> str:
+    '''Returns path to the insertions parquet file of a screen.
+    '''
+
+    return (f'{data_dir}/{screen_name}/{assembly}/{trim_length}/'
+            f'insertions.parquet.snappy')
+
+
+def region_filters(chrom: str, start: int, end: int) -> list:
+    '''Returns pyarrow filters selecting insertions in a region. Same bounds
+    as the original query: 'chr == chrom & pos >= start & pos <= end'.
+    '''
+
+    return [('chr', '==', chrom), ('pos', '>=', start), ('pos', '<=', end)]
+
+
+def compact_insertions(insertions: pd.DataFrame) -> pd.DataFrame:
+    '''Returns insertions with narrow dtypes: 'chr' as a categorical with the
+    shared 'chrom_dtype' dictionary (int8 codes), 'pos' as uint32 and
+    'strand' as int8 (1 for '+', -1 for '-'). Insertions on contigs outside
+    the dictionary are kept, with 'chr' set to 'other': rows are not lost,
+    but the names of these contigs are.
+    '''
+
+    insertions = insertions.copy()
+
+    if 'chr' in insertions:
+        codes = chrom_dtype.categories.get_indexer(insertions['chr'])
+        codes[(codes < 0) & insertions['chr'].notna().values] = len(chroms)
+        insertions['chr'] = pd.Categorical.from_codes(codes, dtype=chrom_dtype)
+    if 'pos' in insertions:
+        insertions['pos'] = insertions['pos'].astype(np.uint32)
+    if ('strand' in insertions
+            and not pd.api.types.is_integer_dtype(insertions['strand'])):
+        insertions['strand'] = np.where(insertions['strand'] == '+', 1,
+                                        -1).astype(np.int8)
+
+    return insertions
+
+
+def read_insertions(data_dir: str, screen_name: str, chrom: str, start: int,
+                    end: int, assembly: str = 'hg38', trim_length: int = 50,
+                    screen_type: str = 'ip',
+                    columns: Optional[List[str]] = None,
+                    compact: bool = False) -> pd.DataFrame:
+    '''Returns insertions of a screen within a region. Chromosome and position
+    filters are pushed down into the parquet reader, so row groups whose
+    statistics fall outside the region are skipped, and only the requested
+    'columns' are read (all of them by default). If the screen has been
+    converted with store.write_store, the partitioned store is used instead.
+    With 'compact', dtypes are narrowed with compact_insertions.
+    '''
+
+    insertions = None
+
+    if screen_type == 'ip' or screen_type == 'pa':
+        filename = insertions_path(data_dir, screen_name, assembly,
+                                   trim_length)
+        try:
+            if has_store(data_dir, screen_name, assembly, trim_length):
+                insertions = read_store_region(data_dir, screen_name, chrom,
+                                               start, end, assembly,
+                                               trim_length, columns)
+            else:
+                insertions = pd.read_parquet(filename, engine='pyarrow',
+                                             columns=columns,
+                                             filters=region_filters(
+                                                 chrom, start, end))
+        except FileNotFoundError:
+            print(f'!! Error: no file found for screen {screen_name} of '
+                  f'type {screen_type}')
+
+    if compact and insertions is not None:
+        insertions = compact_insertions(insertions)
+
+    return insertions
+
+
+def iter_insertions(data_dir: str, screen_name: str,
+                    chrom: Optional[str] = None, start: Optional[int] = None,
+                    end: Optional[int] = None, assembly: str = 'hg38',
+                    trim_length: int = 50,
+                    columns: Optional[List[str]] = None,
+                    batch_size: int = 1_000_000,
+                    compact: bool = False) -> Iterator[pd.DataFrame]:
+    '''Yields the insertions of a screen as dataframes of at most
+    'batch_size' rows, optionally restricted to a chromosome and region
+    (pushed down to the parquet reader). Row groups are read one at a time
+    without read-ahead, so memory is bounded by the batch and row group size
+    and not by the size of the screen. With 'compact', dtypes are narrowed
+    with compact_insertions.
+    '''
+
+    filename = insertions_path(data_dir, screen_name, assembly, trim_length)
+    dataset = ds.dataset(filename, format='parquet')
+
+    conditions = []
+    if chrom is not None:
+        conditions.append(ds.field('chr') == chrom)
+    if start is not None:
+        conditions.append(ds.field('pos') >= start)
+    if end is not None:
+        conditions.append(ds.field('pos') <= end)
+
+    expr = None
+    for condition in conditions:
+        expr = condition if expr is None else expr & condition
+
+    for batch in dataset.to_batches(columns=columns, filter=expr,
+                                    batch_size=batch_size,
+                                    batch_readahead=0, fragment_readahead=0):
+        if batch.num_rows:
+            batch = batch.to_pandas()
+            yield compact_insertions(batch) if compact else batch
+
+
+def reduce_insertions(func: Callable[[Any, pd.DataFrame], Any], initial: Any,
+                      data_dir: str, screen_name: str,
+                      verbose: bool = True, **kwargs) -> tuple:
+    '''Applies 'func(result, batch)' to every batch of iter_insertions
+    (called with 'kwargs'), starting from 'initial', eg to count insertions
+    per chromosome without loading the whole screen. Returns the result and
+    the peak memory seen, in MB: the largest batch, arrow memory in use and
+    the process peak RSS, to size jobs.
+    '''
+
+    result = initial
+    peak = {'batch_mb': 0., 'arrow_mb': 0., 'rss_mb': 0.}
+    n_rows = 0
+
+    for batch in iter_insertions(data_dir, screen_name, **kwargs):
+        result = func(result, batch)
+        n_rows += len(batch)
+        peak['batch_mb'] = max(peak['batch_mb'],
+                               batch.memory_usage(deep=True).sum() / 2**20)
+        peak['arrow_mb'] = max(peak['arrow_mb'],
+                               pa.total_allocated_bytes() / 2**20)
+
+    # ru_maxrss is in KB on Linux
+    peak['rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+    if verbose:
+        print(f'{screen_name}: {n_rows} insertions, peak batch '
+              f'{peak["batch_mb"]:.0f} MB, arrow {peak["arrow_mb"]:.0f} MB, '
+              f'process RSS {peak["rss_mb"]:.0f} MB')
+
+    return result, peak
+
+
+def read_insertions_full(data_dir: str, screen_name: str, chrom: str,
+                         start: int, end: int, assembly: str = 'hg38',
+                         trim_length: int = 50) -> pd.DataFrame:
+    '''Previous read path: loads the whole insertions file and then filters
+    it. Kept as reference for benchmarks.
+    '''
+
+    filename = insertions_path(data_dir, screen_name, assembly, trim_length)
+    insertions = pd.read_parquet(filename)
+    insertions = insertions.query('chr == @chrom '
+                                  '& pos >= @start '
+                                  '& pos <= @end')
+
+    return insertions
+
+
+def read_refseq(data_dir: str, assembly: str = 'hg38',
+                coding_only: Optional[bool] = True,
+                known_only: Optional[bool] = True) -> pd.DataFrame:
+
+    filename = f'{data_dir}/ncbi-genes-{assembly}.parquet.snappy'
+    refseq = pd.read_parquet(filename, engine='pyarrow')
+
+    if coding_only:
+        refseq = refseq[refseq['coding']]
+    if known_only:
+        refseq = refseq[refseq['known']]
+
+    return refseq
+
+
+def convert_position(position: str) -> tuple:
+
+    chrom = f'chr{position.split(":")[0][3:]}'
+
+    # Convert to 0-based left-closed right-open
+    start = int(position.split(':')[1].split('-')[0].replace(',', '')) - 1
+    end = int(position.split(':')[1].split('-')[1].replace(',', ''))
+
+    return (chrom, start, end)
+
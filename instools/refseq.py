@@ -0,0 +1,70 @@
+import pandas as pd
+from functools import lru_cache
+from typing import List
+
+from .reader import read_refseq
+
+
+class RefSeq:
+    '''RefSeq annotation of one assembly, read once, with a gene symbol index.
+    'positions' holds, for every gene, (chrom, start, end, strand): the
+    chromosome and strand of its first transcript, and the min txStart and
+    max txEnd over all its transcripts.
+    '''
+
+    def __init__(self, refseq: pd.DataFrame):
+
+        self.refseq = refseq.reset_index(drop=True)
+
+        # Positional rows of the transcripts of each gene
+        self.rows = self.refseq.groupby('name2', sort=False).indices
+
+        self.positions = self.refseq.groupby('name2', sort=False).agg(
+            chrom=('chrom', 'first'), start=('txStart', 'min'),
+            end=('txEnd', 'max'), strand=('strand', 'first'))
+        self.index = dict(zip(self.positions.index,
+                              self.positions.itertuples(index=False,
+                                                        name=None)))
+
+    def __contains__(self, gene: str) -> bool:
+        return gene in self.index
+
+    def gene_position(self, gene: str) -> tuple:
+        '''Returns (chrom, start, end, strand) of a gene.
+        '''
+
+        try:
+            return self.index[gene]
+        except KeyError:
+            raise KeyError(f'!! Error: gene {gene} not found in refseq')
+
+    def transcripts(self, gene: str) -> pd.DataFrame:
+        '''Returns refseq rows of all transcripts of a gene.
+        '''
+
+        return self.refseq.iloc[self.rows.get(gene, [])]
+
+    def intervals(self, genes: List[str]) -> pd.DataFrame:
+        '''Returns gene positions as a dataframe with columns 'name', 'chrom',
+        'start', 'end' and 'strand'. Genes missing from refseq are reported
+        and left out.
+        '''
+
+        if missing := set(genes).difference(self.index):
+            print(f'!! Warning: {len(missing)} genes not found in refseq: '
+                  f'{missing}')
+
+        found = [gene for gene in dict.fromkeys(genes) if gene in self.index]
+        intervals = self.positions.loc[found].rename_axis('name')
+
+        return intervals.reset_index()
+
+
+@lru_cache(maxsize=None)
+def load_refseq(data_dir: str, assembly: str = 'hg38',
+                coding_only: bool = True, known_only: bool = True) -> RefSeq:
+    '''Returns the RefSeq annotation of an assembly. The parquet file is read
+    only on the first call for each set of arguments in a process.
+    '''
+
+    return RefSeq(read_refseq(data_dir, assembly, coding_only, known_only))
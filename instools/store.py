@@ -0,0 +1,236 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from functools import lru_cache
+from typing import List, Optional
+
+from .overlap import expand_ranges
+
+store_name = 'insertions-by-chr'
+index_name = 'index.parquet'
+
+
+def store_path(data_dir: str, screen_name: str, assembly: str = 'hg38',
+               trim_length: int = 50) -> str:
+    '''Returns path to the chromosome-partitioned insertion store of a screen,
+    next to its flat insertions file.
+    '''
+
+    return f'{data_dir}/{screen_name}/{assembly}/{trim_length}/{store_name}'
+
+
+def source_path(path: str) -> str:
+    '''Returns the flat insertions file a store was written from.'''
+
+    return f'{os.path.dirname(path)}/insertions.parquet.snappy'
+
+
+def source_stat(path: str) -> tuple:
+    '''Returns modification time and size of the flat insertions file of a
+    store, to find stores written from an older version of it.
+    '''
+
+    stat = os.stat(source_path(path))
+
+    return stat.st_mtime_ns, stat.st_size
+
+
+def write_store(data_dir: str, screen_name: str, assembly: str = 'hg38',
+                trim_length: int = 50,
+                row_group_size: int = 50_000) -> pd.DataFrame:
+    '''Rewrites the insertions of a screen as one parquet file per chromosome
+    ('chr=chr9/insertions.parquet.snappy'), sorted by position and split in
+    small row groups. A sidecar index with the min/max position of every row
+    group is written to the store and returned, with the modification time
+    and size of the flat file, checked by has_store.
+    '''
+
+    path = store_path(data_dir, screen_name, assembly, trim_length)
+    filename = source_path(path)
+    mtime, size = source_stat(path)
+
+    chroms = pd.read_parquet(filename, columns=['chr'])['chr'].unique()
+
+    index = []
+    for chrom in sorted(chroms):
+        # One chromosome in memory at a time
+        table = pq.read_table(filename, filters=[('chr', '==', chrom)])
+        table = table.drop_columns(['chr']).sort_by('pos')
+
+        chrom_dir = f'{path}/chr={chrom}'
+        os.makedirs(chrom_dir, exist_ok=True)
+        pq.write_table(table, f'{chrom_dir}/insertions.parquet.snappy',
+                       compression='snappy', row_group_size=row_group_size)
+
+        pos = table.column('pos').to_numpy()
+        first_rows = np.arange(0, len(pos), row_group_size)
+        last_rows = np.minimum(first_rows + row_group_size, len(pos)) - 1
+        index.append(pd.DataFrame({'chr': chrom,
+                                   'row_group': np.arange(len(first_rows)),
+                                   'min_pos': pos[first_rows],
+                                   'max_pos': pos[last_rows],
+                                   'num_rows': last_rows - first_rows + 1}))
+
+    if index:
+        index = pd.concat(index, ignore_index=True)
+    else:
+        index = pd.DataFrame({'chr': pd.Series(dtype=object)} | {
+            c: pd.Series(dtype=np.int64)
+            for c in ['row_group', 'min_pos', 'max_pos', 'num_rows']})
+
+    # The flat file's modification time and size go in the file metadata,
+    # which is kept even when the screen has no insertions
+    table = pa.Table.from_pandas(index, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **table.schema.metadata, b'source_mtime_ns': str(mtime),
+        b'source_size': str(size)})
+    os.makedirs(path, exist_ok=True)
+    pq.write_table(table, f'{path}/{index_name}')
+    read_index.cache_clear()
+    read_source_stat.cache_clear()
+
+    return index
+
+
+@lru_cache(maxsize=None)
+def read_source_stat(path: str) -> Optional[tuple]:
+    '''Returns the modification time and size of the flat file recorded in
+    the index of a store, or None for stores written without them.
+    '''
+
+    metadata = pq.read_schema(f'{path}/{index_name}').metadata or {}
+    if b'source_mtime_ns' not in metadata:
+        return None
+
+    return int(metadata[b'source_mtime_ns']), int(metadata[b'source_size'])
+
+
+def has_store(data_dir: str, screen_name: str, assembly: str = 'hg38',
+              trim_length: int = 50) -> bool:
+    '''True if the screen has a store written from its current flat file.
+    A store whose flat file has since changed is not used (readers fall
+    back to the flat file) until it is rewritten with write_store. A store
+    whose flat file was removed is used.
+    '''
+
+    path = store_path(data_dir, screen_name, assembly, trim_length)
+    if not os.path.exists(f'{path}/{index_name}'):
+        return False
+    if not os.path.exists(source_path(path)):
+        return True
+
+    if read_source_stat(path) != source_stat(path):
+        print(f'!! Warning: store of screen {screen_name} is out of date '
+              f'with its insertions file, run write_store again')
+        return False
+
+    return True
+
+
+@lru_cache(maxsize=None)
+def read_index(path: str) -> dict:
+    '''Returns the row group index of a store as a dict of chromosome to
+    (row_group, min_pos, max_pos) arrays.
+    '''
+
+    index = pd.read_parquet(f'{path}/{index_name}')
+
+    return {chrom: (g['row_group'].values, g['min_pos'].values,
+                    g['max_pos'].values)
+            for chrom, g in index.groupby('chr')}
+
+
+def find_row_groups(path: str, chrom: str, start: int, end: int) -> range:
+    '''Binary search for the row groups of a chromosome that can hold
+    positions in [start, end].
+    '''
+
+    index = read_index(path)
+    if chrom not in index:
+        return range(0)
+
+    row_group, min_pos, max_pos = index[chrom]
+
+    # Rows are sorted by position, so min and max positions of consecutive
+    # row groups are both increasing
+    first = np.searchsorted(max_pos, start, side='left')
+    last = np.searchsorted(min_pos, end, side='right')
+
+    return range(row_group[0] + first, row_group[0] + max(first, last))
+
+
+def read_store_region(data_dir: str, screen_name: str, chrom: str, start: int,
+                      end: int, assembly: str = 'hg38', trim_length: int = 50,
+                      columns: Optional[List[str]] = None) -> pd.DataFrame:
+    '''Returns insertions within [start, end] from the partitioned store,
+    reading only the row groups found in the index.
+    '''
+
+    regions = pd.DataFrame({'chrom': [chrom], 'start': [start], 'end': [end]})
+
+    return read_store_regions(data_dir, screen_name, regions, assembly,
+                              trim_length, columns)
+
+
+def read_store_regions(data_dir: str, screen_name: str, regions: pd.DataFrame,
+                       assembly: str = 'hg38', trim_length: int = 50,
+                       columns: Optional[List[str]] = None) -> pd.DataFrame:
+    '''Returns insertions within many regions ('chrom', 'start', 'end', both
+    ends included, not overlapping, eg from batch.merge_intervals) from the
+    partitioned store. Each chromosome file is opened once, and the union of
+    the row groups of its regions is read in one call.
+    '''
+
+    path = store_path(data_dir, screen_name, assembly, trim_length)
+    index = read_index(path)
+
+    read_cols = None
+    if columns is not None:
+        read_cols = [c for c in columns if c != 'chr']
+        if 'pos' not in read_cols:
+            read_cols = read_cols + ['pos']
+
+    def chrom_file(chrom: str) -> pq.ParquetFile:
+        return pq.ParquetFile(f'{path}/chr={chrom}/insertions.parquet.snappy')
+
+    chunks = []
+    for chrom, group in regions.groupby('chrom', sort=True):
+        if chrom not in index:
+            continue
+
+        group = group.sort_values('start')
+        starts, ends = group['start'].values, group['end'].values
+        row_groups = sorted(set().union(*[find_row_groups(path, chrom, s, e)
+                                          for s, e in zip(starts, ends)]))
+        if not row_groups:
+            continue
+        table = chrom_file(chrom).read_row_groups(row_groups,
+                                                  columns=read_cols)
+
+        # Rows are sorted by position: keep the ones inside the regions
+        pos = table.column('pos').to_numpy()
+        lo = np.searchsorted(pos, starts, side='left')
+        hi = np.searchsorted(pos, ends, side='right')
+        rows, _ = expand_ranges(lo, hi)
+
+        insertions = table.take(rows).to_pandas()
+        insertions.insert(0, 'chr', chrom)
+        chunks.append(insertions)
+
+    # Without insertions, an empty frame with the same columns (only 'chr'
+    # and 'pos' are known for a store without chromosomes)
+    if not chunks and not index:
+        return pd.DataFrame(columns=columns or ['chr', 'pos'])
+    if not chunks:
+        insertions = chrom_file(min(index)).read_row_groups(
+            [], columns=read_cols).to_pandas()
+        insertions.insert(0, 'chr', pd.Series(dtype=object))
+        chunks.append(insertions)
+
+    insertions = pd.concat(chunks, ignore_index=True)
+    if columns is not None:
+        insertions = insertions[columns]
+
+    return insertions
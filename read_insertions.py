@@ -1,6 +1,8 @@
 # %%
 import pandas as pd
-from typing import Optional
+from instools.reader import read_insertions, convert_position
+from instools.refseq import load_refseq
+from instools.batch import get_insertions_batch
 
 screen_type = 'ip'  # 'ip', 'pa'
 screen_name = 'ABC-WNT'
@@ -19,68 +21,6 @@ elif screen_type == 'pa':
 refseq_dir = f'{data_path}/refseq-processed'
 
 
-def read_insertions(data_dir: str, screen_name: str, chrom: str, start: int,
-                    end: int, assembly: str = 'hg38', trim_length: int = 50,
-                    screen_type: str = 'ip') -> pd.DataFrame:
-
-    data_path = (f'{data_dir}/{screen_name}/'
-                 f'{assembly}/{trim_length}/')
-
-    insertions = None
-
-    if screen_type == 'ip' or screen_type == 'pa':
-        filename = 'insertions.parquet.snappy'
-        try:
-            insertions = pd.read_parquet(f'{data_path}{filename}')
-            insertions = insertions.query('chr == @chrom '
-                                          '& pos >= @start '
-                                          '& pos <= @end')
-        except FileNotFoundError:
-            print(f'!! Error: no file found for screen {screen_name} of '
-                  f'type {screen_type}')
-
-    return insertions
-
-
-def read_refseq(data_dir: str, assembly: str = 'hg38',
-                coding_only: Optional[bool] = True,
-                known_only: Optional[bool] = True) -> pd.DataFrame:
-
-    filename = f'{data_dir}/ncbi-genes-{assembly}.parquet.snappy'
-    refseq = pd.read_parquet(filename, engine='pyarrow')
-
-    if coding_only:
-        refseq = refseq[refseq['coding']]
-    if known_only:
-        refseq = refseq[refseq['known']]
-
-    return refseq
-
-
-def convert_position(position: str) -> tuple:
-
-    chrom = f'chr{position.split(":")[0][3:]}'
-
-    # Convert to 0-based left-closed right-open
-    start = int(position.split(':')[1].split('-')[0].replace(',', '')) - 1
-    end = int(position.split(':')[1].split('-')[1].replace(',', ''))
-
-    return (chrom, start, end)
-
-
-def get_gene_position(gene: str, refseq: pd.DataFrame) -> tuple:
-
-    gene_pos = refseq.query('name2 == @gene')
-
-    chrom = gene_pos.chrom.head(1).values[0]
-    start = gene_pos.txStart.min()
-    end = gene_pos.txEnd.max()
-
-    strand = gene_pos.strand.head(1).values[0]
-
-    return (chrom, start, end, strand)
-
-
 def get_insertions(data_dir: str, screen_name: str, select_by: str = 'gene',
                    gene: str = None, position: str = None,
                    screen_type: str = 'ip') -> pd.DataFrame:
@@ -100,8 +40,8 @@ def get_insertions(data_dir: str, screen_name: str, select_by: str = 'gene',
 
     chrom = start = end = None
     if select_by == 'gene':
-        refseq = read_refseq(refseq_dir)
-        chrom, start, end, strand = get_gene_position(gene, refseq)
+        refseq = load_refseq(refseq_dir)
+        chrom, start, end, strand = refseq.gene_position(gene)
         print(f'Gene {gene} is on strand {strand}')
     elif select_by == 'position':
         chrom, start, end = convert_position(position)
@@ -119,3 +59,14 @@ insertions = get_insertions(ins_dir, screen_name, select_by=select_by,
 insertions
 
 # %%
+# Batch query: many genes and/or positions in many screens, one long
+# dataframe tagged with 'name' (gene or position) and 'screen'
+screen_names = ['ABC-WNT']
+genes = ['CD274', 'PDCD1LG2', 'JAK2']
+
+batch_insertions = get_insertions_batch(ins_dir, screen_names, genes=genes,
+                                        refseq=load_refseq(refseq_dir))
+
+batch_insertions
+
+# %%
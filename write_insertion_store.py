@@ -0,0 +1,22 @@
+# %%
+from instools.store import write_store
+
+screen_type = 'ip'  # 'ip', 'pa'
+screen_names = ['ABC-WNT']
+
+data_path = '/media/data/nas_scratch/guizela/data'
+
+# Data directories
+if screen_type == 'ip':
+    ins_dir = f'{data_path}/screen-insertions'
+elif screen_type == 'pa':
+    ins_dir = f'{data_path}/screen-insertions_activating'
+
+# Rewrite each screen as a chromosome-partitioned, position-sorted store.
+# read_insertions uses the store automatically once it exists.
+for screen_name in screen_names:
+    index = write_store(ins_dir, screen_name)
+    print(f'{screen_name}: {index.num_rows.sum()} insertions in '
+          f'{len(index)} row groups')
+
+# %%